@@ -0,0 +1,200 @@
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import numpy as np
+from common import wire
+from common.metrics import Histogram
+from common.transport import MemoryTransport, SharedMemoryRing
+from controller.command_loader import readCsv
+from robot.fleet import RobotFleet
+from sensor.estimator import KalmanEstimator
+from bench.replay import Replay
+
+# logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Benchmark cases by name. Each case is a generator function that sets up, yields the function to time,
+# and tears down when it is resumed.
+CASES = {}
+
+
+def case(name):
+    def register(function):
+        CASES[name] = function
+        return function
+    return register
+
+
+@case('wire.encode')
+def wireEncode():
+    xyz = np.array([1.0, 2.0, 3.0])
+    yield lambda: wire.encode(xyz, seq=1, ts=0)
+
+
+@case('wire.decode')
+def wireDecode():
+    message = wire.encode(np.array([1.0, 2.0, 3.0]), seq=1, ts=0)
+    yield lambda: wire.decode(message)
+
+
+@case('transport.memory.put_take')
+def memoryPutTake():
+    transport = MemoryTransport()
+    xyz = np.array([1.0, 2.0, 3.0])
+
+    def putTake():
+        transport.put('bench', xyz)
+        transport.takeRecord('bench')
+    yield putTake
+
+
+@case('transport.shm.push_pop')
+def shmPushPop():
+    ring = SharedMemoryRing('rcs-bench.%d' % os.getpid(), capacity=64)
+    record = wire.makeRecords(1)[0]
+    try:
+        def pushPop():
+            ring.push(record)
+            ring.pop()
+        yield pushPop
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+@case('estimator.kalman.1000')
+def kalmanStep():
+    estimator = KalmanEstimator()
+    u = np.ones((1000, 3))
+    z = np.ones((1000, 3))
+    yield lambda: estimator.step(u, z)
+
+
+@case('metrics.histogram.observe')
+def histogramObserve():
+    histogram = Histogram()
+    yield lambda: histogram.observe(0.000123)
+
+
+@case('fleet.tick.1000')
+def fleetTick():
+    fleet = RobotFleet(1000, verbose=False, transport=MemoryTransport(), seed=0)
+
+    def tick():
+        fleet.receiveDataFromControllers()
+        fleet.has_command[:] = True
+        fleet.processMoves()
+        fleet.sendPositionsAndAcks()
+    yield tick
+
+
+@case('command_loader.csv.simple')
+def csvLoad():
+    yield lambda: readCsv('data/simple.csv')
+
+
+@case('replay.simple')
+def replaySimple():
+    yield lambda: Replay('data/simple.csv', seed=0).run()
+
+
+# Times function over rounds of enough calls to take at least min_time seconds each.
+# Returns the statistics of the time per call in seconds.
+def measure(function, rounds=5, min_time=0.05):
+    iterations = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        iterations *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    times = [elapsed / iterations]
+    for _ in range(rounds - 1):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            function()
+        times.append((time.perf_counter() - start) / iterations)
+    return {
+        'rounds': rounds,
+        'iterations': iterations,
+        'min': min(times),
+        'max': max(times),
+        'mean': statistics.mean(times),
+        'median': statistics.median(times),
+        'stddev': statistics.stdev(times) if rounds > 1 else 0.0,
+        'ops': 1.0 / statistics.mean(times),
+    }
+
+
+# Runs a case and returns its statistics.
+def runCase(name, rounds=5, min_time=0.05):
+    generator = CASES[name]()
+    function = next(generator)
+    try:
+        return measure(function, rounds=rounds, min_time=min_time)
+    finally:
+        generator.close()
+
+
+# Returns the names of the cases whose minimum time per call grew by more than threshold over the baseline.
+def findRegressions(results, baseline, threshold):
+    regressions = []
+    for name, stats in results.items():
+        if name in baseline and stats['min'] > baseline[name]['min'] * (1 + threshold):
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    # Code for parsing command line arguments
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths and compare against a saved baseline')
+    parser.add_argument('cases', nargs='*', help='Substrings of the names of the cases to run. Defaults to all')
+    parser.add_argument('--list', action='store_true', help='List the cases and exit')
+    parser.add_argument('--rounds', type=int, default=5, help='Number of timed rounds per case')
+    parser.add_argument('--mintime', type=float, default=0.05, help='Minimum seconds per round')
+    parser.add_argument('--save', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Compare the results with a JSON file written by --save')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Fractional slowdown of the minimum time per call that counts as a regression')
+    args = parser.parse_args()
+
+    names = [name for name in CASES if not args.cases or any(pattern in name for pattern in args.cases)]
+    if args.list:
+        for name in names:
+            print(name)
+        return 0
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = {}
+    print('%-32s %12s %12s %12s %12s %14s' % ('case', 'min (us)', 'mean (us)', 'stddev (us)', 'change', 'ops/s'))
+    for name in names:
+        stats = results[name] = runCase(name, rounds=args.rounds, min_time=args.mintime)
+        change = ''
+        if name in baseline:
+            change = '%+.1f%%' % (100.0 * (stats['min'] / baseline[name]['min'] - 1))
+        print('%-32s %12.2f %12.2f %12.2f %12s %14.1f' % (name, stats['min'] * 1e6, stats['mean'] * 1e6,
+                                                          stats['stddev'] * 1e6, change, stats['ops']))
+
+    if args.save:
+        with open(args.save, 'w') as results_file:
+            json.dump(results, results_file, indent=2, sort_keys=True)
+
+    regressions = findRegressions(results, baseline, args.threshold)
+    for name in regressions:
+        logger.error("%s is more than %.0f%% slower than the baseline", name, 100 * args.threshold)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
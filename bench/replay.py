@@ -0,0 +1,177 @@
+import argparse
+import logging
+import time
+import numpy as np
+from common import wire
+from common.transport import DEFAULT_WINDOW, MemoryTransport
+from controller.command_loader import loadCommands
+from controller.controller import Controller
+from robot.robot import Robot
+from sensor.engine import SensorEngine
+from sensor.estimator import createEstimator
+from sensor.sensor1 import Sensor, keySensorToController
+
+# logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+# Simulated time in seconds, advanced by the replay one tick at a time.
+class SimulatedClock:
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+# Stands in for the sensor's InfluxWriter and keeps the points in memory.
+class MemoryWriter:
+    def __init__(self):
+        self.lines = []
+
+    def start(self):
+        pass
+
+    def write(self, line):
+        self.lines.append(line)
+        return True
+
+    def close(self):
+        pass
+
+
+# Runs a controller, robot and sensor in one process through a MemoryTransport.
+# Each tick runs one step of each component in the order their loops would: controller, robot, sensor.
+# Time is simulated, so ticks run back to back, and the robot's errors and noise come from a seeded RNG,
+# so a replay of the same data with the same options always gives the same results.
+class Replay:
+    def __init__(self, data, seed=0, rate=1.0, window=DEFAULT_WINDOW, random_error=1.0, sensor_noise=0.0,
+                 estimator='raw', process_noise=0.25, measurement_noise=0.01, tolerance=0.000001):
+        self.data = data
+
+        # Simulated seconds per tick. Only message expiry depends on it.
+        self.period = 1.0 / rate
+        self.clock = SimulatedClock()
+        self.transport = MemoryTransport(clock=self.clock)
+        self.writer = MemoryWriter()
+
+        self.controller = Controller(data=data, verbose=False, transport=self.transport, window=window)
+        self.controller.readData()
+        self.robot = Robot(np.zeros(3), random_error=random_error, verbose=False, transport=self.transport,
+                           sensor_noise=sensor_noise, window=window, seed=seed)
+        self.sensor = Sensor(None, None, None, None, None, tolerance=tolerance, verbose=False, timeout=0,
+                             transport=self.transport, window=window, writer=self.writer,
+                             estimator=createEstimator(estimator, process_noise=process_noise,
+                                                       measurement_noise=measurement_noise))
+        self.engine = SensorEngine(self.sensor)
+
+        # Where the robot should be after each command, starting from where it is before the first one.
+        commands = np.asarray(loadCommands(data).array)
+        self.planned = np.zeros((len(commands) + 1, 3))
+        np.cumsum(commands, axis=0, out=self.planned[1:])
+
+        # The robot's error on each axis after each tick.
+        self.errors = []
+
+        self.ticks = 0
+        self.seed = seed
+
+    # Runs one step of each component.
+    def tick(self):
+        if self.controller.areCommandsAvailable():
+            self.controller.receiveMessages()
+            self.controller.sendDataToRobot()
+
+        self.robot.receiveDataFromController()
+        if self.robot.areCommandsAvailable():
+            self.robot.fetchAndMove()
+        self.robot.sendPositionAndAck()
+
+        self.engine.step()
+
+        self.errors.append(self.robot.getPosition() - self.planned[self.robot.applied_seq])
+        self.ticks += 1
+        self.clock.advance(self.period)
+
+    # True once every command has been sent and applied.
+    def isDone(self):
+        return not self.controller.areCommandsAvailable() and self.robot.applied_seq == self.controller.next_seq - 1
+
+    # Ticks until every command has been applied or max_ticks have run, and returns the results.
+    def run(self, max_ticks=None):
+        start = time.perf_counter()
+        while not self.isDone() and (max_ticks is None or self.ticks < max_ticks):
+            self.tick()
+        return self.results(time.perf_counter() - start)
+
+    # Returns a dict of the replay's throughput, corrections and errors. Errors are the distance from the planned
+    # location, and the mean absolute error on each axis.
+    # @param elapsed Wall-clock seconds the replay took.
+    def results(self, elapsed):
+        axis_errors = np.array(self.errors).reshape(-1, 3)
+        errors = np.linalg.norm(axis_errors, axis=1)
+        moves = self.robot.applied_seq
+        return {
+            'data': self.data,
+            'seed': self.seed,
+            'ticks': self.ticks,
+            'moves': moves,
+            'seconds': elapsed,
+            'moves_per_second': moves / elapsed if elapsed > 0 else 0.0,
+            'ops_per_tick': self.transport.ops / self.ticks if self.ticks else 0.0,
+            'corrections': self.transport.puts.get(self.sensor.channels[keySensorToController], 0),
+            'points': len(self.writer.lines),
+            'mean_abs_error': float(errors.mean()) if len(errors) else 0.0,
+            'mean_abs_axis_errors': np.abs(axis_errors).mean(axis=0).tolist() if len(errors) else [0.0] * 3,
+            'rms_error': float(np.sqrt((errors ** 2).mean())) if len(errors) else 0.0,
+            'max_abs_error': float(errors.max()) if len(errors) else 0.0,
+            'final_error': float(errors[-1]) if len(errors) else 0.0,
+        }
+
+
+def main():
+    # Code for parsing command line arguments
+    parser = argparse.ArgumentParser(description='Replay command files through the controller, robot and sensor '
+                                                 'in one process')
+    parser.add_argument('data', nargs='*', default=['data/simple.csv', 'data/zeros.csv'],
+                        help='Command files to replay. Defaults to the files in ./data')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the robot\'s random errors and noise')
+    parser.add_argument('--rate', type=float, default=1.0, help='Simulated ticks per second')
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW,
+                        help='Number of commands the controller may have in flight')
+    parser.add_argument('--randomerror', type=wire.parseAxes, default=1.0,
+                        help='Largest random error the robot makes per move, on every axis or on each axis given '
+                             'as x,y,z')
+    parser.add_argument('--noerror', action='store_true', help='If true, the robot does not randomly err')
+    parser.add_argument('--sensornoise', type=float, default=0.0,
+                        help='Standard deviation of the noise added to the positions reported to the sensor')
+    parser.add_argument('--estimator', choices=['raw', 'kalman'], default='raw',
+                        help='Estimator the sensor uses')
+    parser.add_argument('--processnoise', type=float, default=0.25, help='Kalman filter process variance')
+    parser.add_argument('--measurementnoise', type=float, default=0.01, help='Kalman filter measurement variance')
+    parser.add_argument('--tolerance', type=wire.parseAxes, default=0.000001,
+                        help='Smallest error the sensor will correct, on every axis or on each axis given as x,y,z')
+    parser.add_argument('--maxticks', type=int, help='Stop each replay after this many ticks')
+    args = parser.parse_args()
+
+    for data in args.data:
+        replay = Replay(data, seed=args.seed, rate=args.rate, window=args.window,
+                        random_error=0.0 if args.noerror else args.randomerror,
+                        sensor_noise=args.sensornoise, estimator=args.estimator, process_noise=args.processnoise,
+                        measurement_noise=args.measurementnoise, tolerance=args.tolerance)
+        results = replay.run(max_ticks=args.maxticks)
+        logger.info("%s: %d moves in %d ticks, %.3f s, %.0f moves/s, %.2f memcached ops per tick", data,
+                    results['moves'], results['ticks'], results['seconds'], results['moves_per_second'],
+                    results['ops_per_tick'])
+        logger.info("%s: %d corrections, error mean %.4f rms %.4f max %.4f final %.4f, "
+                    "mean |x| %.4f |y| %.4f |z| %.4f", data, results['corrections'], results['mean_abs_error'],
+                    results['rms_error'], results['max_abs_error'], results['final_error'],
+                    *results['mean_abs_axis_errors'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import logging
+import os
+import subprocess
+import sys
+
+# logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Repository root, which the modules are imported from.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules the components are started from.
+ENTRY_MODULES = ('controller.controller', 'robot.robot', 'robot.fleet', 'sensor.sensor1', 'sensor.pool',
+                 'supervisor.supervisor')
+
+# Optional or slow modules that must only be imported when they are used, e.g. by the GUI or the DB writer.
+LAZY_MODULES = ('tkinter', 'influxdb', 'pylibmc', 'http.server', 'urllib.request')
+
+
+# Imports a module in a new interpreter with -X importtime. Returns a dict of every module imported to the
+# microseconds it took including its own imports, and a dict of every module to the modules it imported directly.
+def measureImport(module, timeout=60.0):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module], cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True,
+                            timeout=timeout)
+    if result.returncode:
+        raise RuntimeError('importing %s failed:\n%s' % (module, result.stderr))
+    times = {}
+    imports = {}
+
+    # Modules waiting for the module that imported them at each depth. A module is listed after its imports.
+    pending = [[]]
+    for line in result.stderr.splitlines()[1:]:
+        # e.g. "import time:       776 |      13493 |   common.transport", indented two spaces per depth.
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        times[name] = int(cumulative)
+        pending.extend([] for _ in range(depth + 2 - len(pending)))
+        imports[name] = pending[depth + 1]
+        pending[depth + 1] = []
+        pending[depth].append(name)
+    return times, imports
+
+
+# Returns the names of module and the packages it is in, e.g. 'robot' and 'robot.fleet'.
+def packages(module):
+    parts = module.split('.')
+    return ['.'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+
+# Returns the microseconds importing module took, counting the packages it is in.
+def importTime(module, times):
+    return sum(times.get(package, 0) for package in packages(module))
+
+
+def main():
+    # Code for parsing command line arguments
+    parser = argparse.ArgumentParser(description='Measure how long importing each component\'s entry module takes '
+                                                 'and check it against a budget')
+    parser.add_argument('modules', nargs='*', default=ENTRY_MODULES, help='Modules to import. Defaults to all')
+    parser.add_argument('--budget', type=float, default=300.0,
+                        help='Milliseconds an import may take, the fastest of --repeat, before it fails')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of times each module is imported')
+    parser.add_argument('--top', type=int, default=0, help='Also list the slowest top level imports of each module')
+    args = parser.parse_args()
+
+    failed = False
+    print('%-24s %12s %12s' % ('module', 'min (ms)', 'max (ms)'))
+    for module in args.modules:
+        runs = [measureImport(module) for _ in range(args.repeat)]
+        totals = [importTime(module, times) / 1000.0 for times, _ in runs]
+        print('%-24s %12.1f %12.1f' % (module, min(totals), max(totals)))
+
+        times, imports = min(runs, key=lambda run: importTime(module, run[0]))
+        direct = [name for package in packages(module) for name in imports.get(package, [])]
+        for name in sorted(direct, key=times.get, reverse=True)[:args.top]:
+            print('    %-20s %12.1f' % (name, times[name] / 1000.0))
+        if min(totals) > args.budget:
+            logger.error("Importing %s takes %.1f ms, over the budget of %.1f ms", module, min(totals), args.budget)
+            failed = True
+        eager = [name for name in LAZY_MODULES if name in times]
+        if eager:
+            logger.error("Importing %s imports %s, which should only be imported when used", module,
+                         ', '.join(eager))
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
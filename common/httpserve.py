@@ -0,0 +1,27 @@
+import threading
+
+
+# Serves the Prometheus text body returns on http://localhost:<port>/metrics from a background thread.
+# Returns the server, which is stopped with shutdown. Kept apart from common.metrics, which imports numpy, so the
+# supervisor can serve its components' metrics without it.
+def serveMetrics(port, body):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            text = body().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(text)))
+            self.end_headers()
+            self.wfile.write(text)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('', port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
@@ -0,0 +1,213 @@
+import logging
+import math
+import numbers
+import queue
+import threading
+import time
+import numpy as np
+
+# logging
+logger = logging.getLogger(__name__)
+
+
+# Escapes a measurement name, tag key or tag value for InfluxDB line protocol.
+def escapeKey(value):
+    return str(value).replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+
+# Formats a single field value for InfluxDB line protocol, e.g. numpy integers as integers.
+# Returns None for NaN and infinity, which line protocol cannot represent.
+def formatField(value):
+    if isinstance(value, (bool, np.bool_)):
+        return 'true' if value else 'false'
+    if isinstance(value, numbers.Integral):
+        return '%di' % value
+    if isinstance(value, str):
+        return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    value = float(value)
+    if not math.isfinite(value):
+        return None
+    return repr(value)
+
+
+# Formats a point as a line protocol string. Fields that cannot be represented are left out.
+# Returns None if no field is left, since a point needs at least one.
+# @param timestamp_ns Integer nanoseconds since the epoch. Defaults to the current time.
+def formatLine(measurement, fields, tags=None, timestamp_ns=None):
+    if timestamp_ns is None:
+        timestamp_ns = time.time_ns()
+    key = escapeKey(measurement)
+    if tags:
+        key += ''.join(',%s=%s' % (escapeKey(k), escapeKey(v)) for k, v in sorted(tags.items()))
+    formatted = ((k, formatField(v)) for k, v in fields.items())
+    field_set = ','.join('%s=%s' % (escapeKey(k), v) for k, v in formatted if v is not None)
+    if not field_set:
+        return None
+    return '%s %s %d' % (key, field_set, timestamp_ns)
+
+
+# Writes line protocol points to InfluxDB in batches on a background thread.
+# Points are held in a bounded in-memory queue, or, if a common.spool.Spool is given, appended to the spool
+# on disk and shipped from there with retries, so they survive DB outages and restarts.
+class InfluxWriter:
+    # HTTP status codes of writes rejected because of the client or the database rather than the points, which may
+    # succeed once the configuration is fixed. Batches rejected with any other 4xx code are dropped.
+    RETRIED_CODES = (401, 403, 404)
+
+    def __init__(self, client, db_name, batch_size=500, flush_interval=1.0, queue_size=10000, overflow='drop',
+                 spool=None, max_backoff=30.0):
+        # InfluxDBClient used to write batches.
+        self.client = client
+
+        # Influx Database to write to.
+        self.db_name = db_name
+
+        # A batch is written once it holds this many points...
+        self.batch_size = batch_size
+
+        # ...or once this many seconds have passed since the last write.
+        self.flush_interval = flush_interval
+
+        # Points waiting to be written. Bounded so a slow DB cannot exhaust memory.
+        self.points = queue.Queue(maxsize=queue_size)
+
+        # What to do when the queue is full: 'drop' discards the new point, 'block' makes the caller wait.
+        if overflow not in ('drop', 'block'):
+            raise ValueError("overflow must be 'drop' or 'block', not %r" % overflow)
+        self.overflow = overflow
+
+        # Number of points discarded because the queue was full.
+        self.dropped = 0
+
+        # Number of points discarded because the DB rejected them.
+        self.rejected = 0
+
+        # Spool that points are written to instead of the queue, if set.
+        self.spool = spool
+
+        # Longest wait in seconds between attempts to ship spooled points while the DB is failing.
+        self.max_backoff = max_backoff
+
+        # Set to False if the database does not exist, in which case points are discarded.
+        self.db_exists = False
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Checks the database once and starts the background writer thread.
+    # Spooled points are kept and retried even if the database is not found.
+    def start(self):
+        if self.spool is not None:
+            self._thread = threading.Thread(target=self._ship, name='influx-shipper', daemon=True)
+            self._thread.start()
+            return
+        try:
+            self.db_exists = {'name': self.db_name} in self.client.get_list_database()
+        except Exception as exception:
+            logger.error("Exception checking DB: %s", exception)
+        if not self.db_exists:
+            logger.warning("Database %s not found, telemetry will not be written", self.db_name)
+        self._thread = threading.Thread(target=self._run, name='influx-writer', daemon=True)
+        self._thread.start()
+
+    # Queues a line protocol point for writing. Never performs network I/O on the calling thread.
+    def write(self, line):
+        if self.spool is not None:
+            self.spool.append(line.encode())
+            return True
+        if self.overflow == 'block':
+            self.points.put(line)
+            return True
+        try:
+            self.points.put_nowait(line)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    # Stops the writer thread after flushing any queued points.
+    def close(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    # Writes a batch of line protocol points to the DB. Returns False if the write failed and may succeed if retried.
+    # A batch the DB rejects as too large is written in halves, and one it rejects as invalid, e.g. for a field of
+    # the wrong type, is dropped, since retrying it would fail the same way and hold up every point after it.
+    def flush(self, batch):
+        if not batch:
+            return True
+        if self.spool is None and not self.db_exists:
+            return False
+        try:
+            self.client.write_points(batch, time_precision='n', database=self.db_name, protocol='line')
+            logger.debug("Wrote %d points to DB", len(batch))
+            return True
+        except Exception as exception:
+            # InfluxDBClientError carries the HTTP status code of a 4xx response. Other errors do not.
+            code = getattr(exception, 'code', None)
+            if code == 413 and len(batch) > 1:
+                logger.warning("DB rejected %d points as too large, writing them in halves", len(batch))
+                half = len(batch) // 2
+                return self.flush(batch[:half]) and self.flush(batch[half:])
+            if isinstance(code, int) and 400 <= code < 500 and code not in self.RETRIED_CODES:
+                logger.error("DB rejected %d points, dropping them: %s", len(batch), exception)
+                self.rejected += len(batch)
+                return True
+            logger.error("Exception writing %d points to DB: %s", len(batch), exception)
+            return False
+
+    # Ships spooled points to the DB in batches until stopped. A batch is only removed from the spool once it
+    # is written. After a failure the batch is retried, waiting twice as long each time up to max_backoff.
+    # On stop, ships what it can without waiting and leaves the rest in the spool for the next run.
+    def _ship(self):
+        backoff = 0.0
+        while True:
+            records, position = self.spool.read(self.batch_size)
+            if records and self.flush([record.decode() for record in records]):
+                self.spool.commit(position)
+                backoff = 0.0
+                if len(records) == self.batch_size and not self._stop.is_set():
+                    # More points are waiting.
+                    continue
+            elif records:
+                backoff = min(max(2 * backoff, self.flush_interval), self.max_backoff)
+                logger.warning("Retrying %d spooled points in %.1f s, %d bytes waiting", len(records), backoff,
+                               self.spool.pending())
+            if self._stop.is_set() or self._stop.wait(backoff or self.flush_interval):
+                break
+        while True:
+            records, position = self.spool.read(self.batch_size)
+            if not records or not self.flush([record.decode() for record in records]):
+                break
+            self.spool.commit(position)
+        self.spool.close()
+
+    # Drains the queue into batches until stopped, then writes whatever is left.
+    # Points are discarded if the DB was not found or the write fails.
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        reported_drops = 0
+        while not self._stop.is_set():
+            try:
+                batch.append(self.points.get(timeout=max(0.0, min(deadline - time.monotonic(), 0.1))))
+            except queue.Empty:
+                pass
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self.flush(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+                if self.dropped != reported_drops:
+                    logger.warning("Dropped %d points because the write queue was full", self.dropped - reported_drops)
+                    reported_drops = self.dropped
+        while True:
+            try:
+                batch.append(self.points.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = []
+        self.flush(batch)
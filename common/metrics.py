@@ -0,0 +1,213 @@
+import logging
+import math
+import threading
+import time
+import numpy as np
+from common.httpserve import serveMetrics
+from common.influx_writer import InfluxWriter, formatLine
+
+# logging
+logger = logging.getLogger(__name__)
+
+
+# Histogram of durations in seconds, or of counts, with log-spaced buckets, BUCKETS_PER_DECADE per power of ten
+# from MIN_VALUE to MAX_VALUE. Quantiles are accurate to within one bucket, about 12%.
+class Histogram:
+    MIN_VALUE = 1e-7
+    MAX_VALUE = 1e3
+    BUCKETS_PER_DECADE = 20
+
+    def __init__(self):
+        decades = math.log10(self.MAX_VALUE / self.MIN_VALUE)
+        self.counts = np.zeros(int(decades * self.BUCKETS_PER_DECADE) + 2, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    # Records one value. Counts are kept as floats too, so a field always has the same type in the DB.
+    def observe(self, value):
+        value = float(value)
+        if value <= self.MIN_VALUE:
+            index = 0
+        else:
+            index = min(int(math.log10(value / self.MIN_VALUE) * self.BUCKETS_PER_DECADE) + 1, len(self.counts) - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    # Returns the upper edge of the bucket holding quantile q, or 0.0 if nothing was recorded.
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        index = int(np.searchsorted(np.cumsum(self.counts), q * self.count))
+        return min(self.MIN_VALUE * 10 ** (index / self.BUCKETS_PER_DECADE), self.max)
+
+
+# Named histograms for one process. Safe to use from several threads.
+# Each histogram holds either durations, in 'seconds', or per-tick counts, in 'count'.
+class Metrics:
+    def __init__(self, component='rcs'):
+        # Name of the process the metrics describe, e.g. 'controller'.
+        self.component = component
+        self.histograms = {}
+        self.units = {}
+        self.lock = threading.Lock()
+
+    # Records a duration in seconds.
+    def observe(self, name, seconds):
+        self.record(name, seconds, 'seconds')
+
+    # Records a count, e.g. of the round trips made in one tick.
+    def observeCount(self, name, count):
+        self.record(name, count, 'count')
+
+    def record(self, name, value, unit):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+                self.units[name] = unit
+            histogram.observe(value)
+
+    # Records the time from a wire record's timestamp until now as a hop latency.
+    def observeHop(self, name, record):
+        self.observe('hop.' + name, (time.monotonic_ns() - int(record['ts'])) / 1e9)
+
+    # Context manager that records the time spent in its body.
+    def timer(self, name):
+        return _Timer(self, name)
+
+    # Returns a dict of name to count, mean, p50, p99, max and unit, and starts new histograms.
+    def snapshot(self, reset=True):
+        with self.lock:
+            histograms = self.histograms
+            units = dict(self.units)
+            if reset:
+                self.histograms = {}
+        return {name: {'count': histogram.count, 'mean': float(histogram.total / histogram.count),
+                       'p50': float(histogram.quantile(0.5)), 'p99': float(histogram.quantile(0.99)),
+                       'max': float(histogram.max), 'unit': units[name]}
+                for name, histogram in histograms.items() if histogram.count}
+
+
+class _Timer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+# Prometheus metric family for each unit.
+PROMETHEUS_FAMILIES = {'seconds': 'rcs_latency_seconds', 'count': 'rcs_per_tick'}
+
+
+# Formats a snapshot in the Prometheus text exposition format.
+def formatPrometheus(component, snapshot):
+    lines = []
+    for unit, family in sorted(PROMETHEUS_FAMILIES.items()):
+        lines.append('# TYPE %s summary' % family)
+        for name, values in sorted(snapshot.items()):
+            if values['unit'] != unit:
+                continue
+            labels = 'component="%s",metric="%s"' % (component, name)
+            lines.append('%s{%s,quantile="0.5"} %r' % (family, labels, values['p50']))
+            lines.append('%s{%s,quantile="0.99"} %r' % (family, labels, values['p99']))
+            lines.append('%s_sum{%s} %r' % (family, labels, values['mean'] * values['count']))
+            lines.append('%s_count{%s} %d' % (family, labels, values['count']))
+    return '\n'.join(lines) + '\n'
+
+
+# Periodically exports a process's metrics to InfluxDB through an InfluxWriter, and optionally serves the
+# latest snapshot as Prometheus text on http://localhost:<http_port>/metrics.
+class MetricsReporter:
+    # InfluxDB measurement for each unit.
+    MEASUREMENTS = {'seconds': 'latency', 'count': 'per_tick'}
+
+    def __init__(self, metrics, writer=None, interval=10.0, http_port=None, close_writer=False):
+        self.metrics = metrics
+        self.writer = writer
+
+        # True if the writer belongs to the reporter and is closed with it.
+        self.close_writer = close_writer
+        self.interval = interval
+        self.http_port = http_port
+
+        # Latest snapshot, served over HTTP.
+        self.latest = {}
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._server = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='metrics-reporter', daemon=True)
+        self._thread.start()
+        if self.http_port is not None:
+            self._server = serveMetrics(self.http_port,
+                                        lambda: formatPrometheus(self.metrics.component, self.latest))
+
+    # Exports one snapshot.
+    def report(self):
+        self.latest = self.metrics.snapshot()
+        if self.writer is not None:
+            timestamp_ns = time.time_ns()
+            for name, values in self.latest.items():
+                fields = {key: value for key, value in values.items() if key != 'unit'}
+                self.writer.write(formatLine(self.MEASUREMENTS[values['unit']], fields, timestamp_ns=timestamp_ns,
+                                             tags={'component': self.metrics.component, 'metric': name}))
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5.0)
+            self._thread = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+        self.report()
+        if self.close_writer:
+            self.writer.close()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+
+# Adds the command line arguments for exporting metrics.
+# Processes without their own InfluxDB connection use the --influx* arguments.
+def addMetricsArguments(parser, influx=True):
+    parser.add_argument('--metricsinterval', type=float, default=10.0, help='Seconds between metrics exports')
+    parser.add_argument('--metricsport', type=int, help='Serve Prometheus metrics on this port if set')
+    if influx:
+        parser.add_argument('--influxhost', help='Host for exporting metrics to InfluxDB. Not exported if unset')
+        parser.add_argument('--influxport', type=int, default=8086, help='Port for exporting metrics to InfluxDB')
+        parser.add_argument('--influxuser', help='Username for exporting metrics to InfluxDB')
+        parser.add_argument('--influxpassword', help='Password for exporting metrics to InfluxDB')
+        parser.add_argument('--influxdb', default='sensor', help='Database for exporting metrics to InfluxDB')
+
+
+# Creates and starts a MetricsReporter from the command line arguments.
+# @param writer InfluxWriter to export through. If None, one is created from the --influx* arguments if given.
+def startMetrics(args, metrics, writer=None):
+    close_writer = False
+    if writer is None and getattr(args, 'influxhost', None):
+        from influxdb import InfluxDBClient
+
+        client = InfluxDBClient(host=args.influxhost, port=args.influxport, username=args.influxuser,
+                                password=args.influxpassword, database=args.influxdb)
+        writer = InfluxWriter(client, args.influxdb)
+        writer.start()
+        close_writer = True
+    reporter = MetricsReporter(metrics, writer=writer, interval=args.metricsinterval, http_port=args.metricsport,
+                               close_writer=close_writer)
+    reporter.start()
+    return reporter
@@ -0,0 +1,21 @@
+import logging
+import os
+
+# logging
+logger = logging.getLogger(__name__)
+
+# Environment variable holding the file descriptor a supervisor waits on until the process is ready.
+READY_FD = 'RCS_READY_FD'
+
+
+# Tells the supervisor that started this process, if any, that it is ready: connected, loaded and about to
+# start its loop. Only the first call has any effect. The variable is removed, so child processes do not inherit it.
+def notifyReady():
+    fd = os.environ.pop(READY_FD, None)
+    if fd is None:
+        return
+    try:
+        os.write(int(fd), b'ready\n')
+        os.close(int(fd))
+    except (OSError, ValueError) as exception:
+        logger.warning("Could not notify the supervisor: %s", exception)
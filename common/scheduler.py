@@ -0,0 +1,156 @@
+import logging
+import threading
+import time
+
+# logging
+logger = logging.getLogger(__name__)
+
+
+class FixedRateScheduler:
+    def __init__(self, rate, tick, spin=0.0002, metrics=None):
+        # Ticks per second. Must be positive.
+        if rate <= 0:
+            raise ValueError("rate must be positive, not %r" % rate)
+        self.period = 1.0 / rate
+
+        # Function called once per tick.
+        self.tick = tick
+
+        # The last this many seconds before a deadline are busy-waited instead of slept,
+        # since sleeping is only accurate to a fraction of a millisecond.
+        self.spin = spin
+
+        # common.metrics.Metrics that the duration of each tick is recorded in as 'loop', if set.
+        self.metrics = metrics
+
+        # Number of ticks run so far.
+        self.ticks = 0
+
+        # Number of ticks skipped because a tick overran its deadline.
+        self.overruns = 0
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Runs ticks on the calling thread until stopped.
+    # Deadlines are absolute so that time spent in tick() and sleep inaccuracy do not accumulate as drift.
+    def run(self):
+        next_time = time.perf_counter()
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            busy = self.tick()
+            self.ticks += 1
+            next_time += self.period
+            now = time.perf_counter()
+            if self.metrics is not None:
+                self.metrics.observe('loop', now - start)
+            if now > next_time:
+                # Fell behind: skip the missed ticks rather than running them back to back.
+                missed = int((now - next_time) / self.period) + 1
+                self.overruns += missed
+                next_time += missed * self.period
+            next_time = self.pause(busy, start, next_time)
+
+    # Waits between ticks, until the deadline of the next one. Returns that deadline.
+    # @param busy What tick() returned.
+    # @param start When the tick started.
+    def pause(self, busy, start, next_time):
+        self.waitUntil(next_time)
+        return next_time
+
+    # Sleeps until the deadline, busy-waiting for the last spin seconds.
+    def waitUntil(self, deadline):
+        remaining = deadline - time.perf_counter() - self.spin
+        if remaining > 0 and self._stop.wait(remaining):
+            return
+        while time.perf_counter() < deadline:
+            pass
+
+    # Runs ticks on a background thread.
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='scheduler', daemon=True)
+        self._thread.start()
+
+    # Stops the scheduler after the current tick.
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+            self._thread = None
+
+    # Runs ticks on the calling thread until stopped or interrupted with Ctrl-C.
+    def runForever(self):
+        try:
+            self.run()
+        except KeyboardInterrupt:
+            logger.info("Interrupted after %s", self.describe())
+
+    # Summarizes the ticks run so far.
+    def describe(self):
+        return '%d ticks (%d overruns)' % (self.ticks, self.overruns)
+
+
+# Scheduler that ticks at up to max_rate while tick() returns True, i.e. it found work to do, and backs off
+# exponentially down to min_rate while it returns False. An idle wait ends early if wakeup is notified, e.g. by
+# another component that has just published a message for this one, but ticks never come faster than max_rate.
+class AdaptiveScheduler(FixedRateScheduler):
+    def __init__(self, min_rate, max_rate, tick, backoff=2.0, wakeup=None, spin=0.0002, metrics=None):
+        super().__init__(max_rate, tick, spin=spin, metrics=metrics)
+        if not 0 < min_rate <= max_rate:
+            raise ValueError("min_rate must be positive and at most max_rate, not %r" % min_rate)
+
+        # Longest time between ticks, and how much the time between idle ticks grows after each one.
+        self.max_period = 1.0 / min_rate
+        self.backoff = backoff
+
+        # common.wakeup.WakeUp ending idle waits. Waits run their full time if it is not listening.
+        self.wakeup = wakeup if wakeup is not None and wakeup.listening else None
+
+        # Time from the start of an idle tick to the start of the next tick.
+        self.idle_period = self.period
+
+        # Number of ticks that found no work, and of idle waits ended by a wake-up.
+        self.idle_ticks = 0
+        self.wakeups = 0
+
+    def pause(self, busy, start, next_time):
+        self.waitUntil(next_time)
+        if busy:
+            self.idle_period = self.period
+            return next_time
+        self.idle_ticks += 1
+        self.idle_period = min(self.idle_period * self.backoff, self.max_period)
+        if self.waitIdle(start + self.idle_period):
+            self.wakeups += 1
+
+        # Deadlines start again from the end of the wait.
+        return max(next_time, time.perf_counter())
+
+    # Waits until the deadline, a wake-up or stop. Returns True if woken.
+    def waitIdle(self, deadline):
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return False
+        if self.wakeup is None:
+            self._stop.wait(remaining)
+            return False
+        return self.wakeup.wait(remaining) and not self._stop.is_set()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self.wakeup is not None:
+            self.wakeup.wake()
+        super().stop(timeout)
+
+    def describe(self):
+        return '%s, %d idle, %d woken' % (super().describe(), self.idle_ticks, self.wakeups)
+
+
+# Adds the command line arguments for the adaptive scheduler. Each component has its own maximum rate.
+# Processes that do not listen for wake-ups leave out --nowakeup.
+def addSchedulerArguments(parser, wakeup=True):
+    parser.add_argument('--minrate', type=float, default=1.0,
+                        help='Ticks per second to back off to while idle. The maximum rate if lower')
+    if wakeup:
+        parser.add_argument('--nowakeup', action='store_true',
+                            help='If true, do not listen for or send wake-ups to components on this host, only poll')
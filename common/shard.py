@@ -0,0 +1,101 @@
+import bisect
+import hashlib
+import logging
+import time
+from common import wire
+
+# logging
+logger = logging.getLogger(__name__)
+
+
+# Returns a stable 64-bit hash of a key's string form, the same in every process.
+def hashKey(key):
+    return int.from_bytes(hashlib.md5(str(key).encode()).digest()[:8], 'little')
+
+
+# Consistent hash ring. Each node is placed at replicas points on the ring and a key belongs to the node at the
+# first point at or after the key's hash, so adding or removing a node only moves the keys of its own points.
+class HashRing:
+    def __init__(self, nodes=(), replicas=100):
+        self.nodes = sorted(set(nodes))
+        points = sorted((hashKey('%s-%d' % (node, i)), node) for node in self.nodes for i in range(replicas))
+        self.points = [point for point, _ in points]
+        self.owners = [node for _, node in points]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    # Returns the node a key belongs to, or None if the ring is empty.
+    def nodeFor(self, key):
+        if not self.points:
+            return None
+        i = bisect.bisect_left(self.points, hashKey(key))
+        return self.owners[i % len(self.owners)]
+
+    # Returns the keys that belong to node, in their original order.
+    def keysFor(self, node, keys):
+        return [key for key in keys if self.nodeFor(key) == node]
+
+
+# Membership of a group of processes, e.g. the sensors sharing a fleet, kept in a transport shared by all of them.
+# Each member holds one of a fixed number of slot channels, e.g. 'Sensor.Member.3', claimed with addBatch and
+# kept alive by heartbeats with a ttl. A member that stops heartbeating expires and is dropped by the others.
+# The slot's record carries the member's token, a hash of its ID, in its seq, so a restarted member rejoins
+# with the same token and gets the same shard back. Member IDs must be unique within the group.
+class Membership:
+    def __init__(self, transport, member_id, group='Sensor', slots=64, ttl=3):
+        # Transport shared by every member. Must support getBatches and addBatch, e.g. memcached.
+        self.transport = transport
+
+        # ID of this process and the token it is known by on the ring.
+        self.member_id = member_id
+        self.token = hashKey(member_id)
+
+        # Channels of the slots. The group cannot have more members than slots.
+        self.channels = ['%s.Member.%d' % (group, i) for i in range(slots)]
+
+        # Seconds a slot lives without a heartbeat. Must be longer than the time between heartbeats.
+        self.ttl = ttl
+
+        # Channel of the slot this member holds, or None before it has joined.
+        self.slot = None
+
+        self.records = wire.makeRecords(1)
+        self.records['seq'] = self.token
+
+    # Refreshes this member's slot, claiming one if it has none, and returns the set of live members' tokens.
+    # This member is only included once it holds a slot.
+    # Two round trips when the member already holds its slot.
+    def heartbeat(self):
+        batches = self.transport.getBatches(self.channels)
+        owners = {channel: int(records[0]['seq']) for channel, records in batches.items()}
+        if self.slot is not None and owners.get(self.slot) != self.token:
+            logger.warning("Member %s lost its slot %s, rejoining", self.member_id, self.slot)
+            self.slot = None
+        if self.slot is None:
+            # A previous run of this member may still hold a slot.
+            self.slot = next((channel for channel, token in owners.items() if token == self.token), None)
+        self.records['ts'] = time.monotonic_ns()
+        if self.slot is not None:
+            self.transport.putBatch(self.slot, self.records, ttl=self.ttl)
+        else:
+            self.join(owners)
+        members = set(owners.values())
+        if self.slot is not None:
+            members.add(self.token)
+        return members
+
+    # Claims the first free slot.
+    def join(self, owners):
+        for channel in self.channels:
+            if channel not in owners and self.transport.addBatch(channel, self.records, ttl=self.ttl):
+                self.slot = channel
+                logger.info("Member %s joined as %s", self.member_id, channel)
+                return
+        logger.error("Member %s could not join: all %d slots are taken", self.member_id, len(self.channels))
+
+    # Gives up this member's slot, so the other members take over its shard without waiting for it to expire.
+    def leave(self):
+        if self.slot is not None:
+            self.transport.discard(self.slot)
+            self.slot = None
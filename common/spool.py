@@ -0,0 +1,162 @@
+import logging
+import os
+import struct
+import threading
+import zlib
+
+# logging
+logger = logging.getLogger(__name__)
+
+
+# Append-only on-disk queue of byte records, split into segment files that are deleted once read.
+# Each record is framed as (uint32 length, uint32 CRC-32) followed by its bytes, so a record torn by a crash
+# is detected and skipped. The reader's position is kept in a cursor file, so records survive restarts until
+# they are committed. The spool is bounded: once it holds more than max_bytes, the oldest segments are
+# discarded. Safe to use from one writer and one reader thread.
+class Spool:
+    FRAME = struct.Struct('<II')
+    SUFFIX = '.seg'
+    CURSOR = 'cursor'
+
+    def __init__(self, directory, segment_size=4 * 1024 * 1024, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+
+        # A new segment is started once the current one holds this many bytes.
+        self.segment_size = segment_size
+
+        # Largest number of bytes kept on disk. Must allow at least two segments.
+        if max_bytes < 2 * segment_size:
+            raise ValueError("max_bytes must be at least two segments, not %r" % max_bytes)
+        self.max_bytes = max_bytes
+
+        # Number of bytes discarded because the spool was full.
+        self.dropped_bytes = 0
+
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        # Size of each segment on disk, by segment number, oldest first.
+        self.sizes = {}
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(self.SUFFIX):
+                self.sizes[int(name[:-len(self.SUFFIX)])] = os.path.getsize(os.path.join(directory, name))
+        self.total = sum(self.sizes.values())
+
+        # Segment and offset of the next record to read.
+        self.read_segment, self.read_offset = self._loadCursor()
+        for segment in [segment for segment in self.sizes if segment < self.read_segment]:
+            self._delete(segment)
+
+        # Records are always appended to a new segment, since the last one may end in a torn record.
+        self.write_segment = max(list(self.sizes) + [self.read_segment - 1]) + 1
+        self._file = None
+        self._open(self.write_segment)
+        if self.read_segment not in self.sizes:
+            self.read_segment, self.read_offset = min(self.sizes), 0
+
+    def _path(self, segment):
+        return os.path.join(self.directory, '%020d%s' % (segment, self.SUFFIX))
+
+    def _loadCursor(self):
+        try:
+            with open(os.path.join(self.directory, self.CURSOR)) as cursor_file:
+                segment, offset = cursor_file.read().split()
+            return int(segment), int(offset)
+        except (OSError, ValueError):
+            return (min(self.sizes) if self.sizes else 0), 0
+
+    def _saveCursor(self):
+        path = os.path.join(self.directory, self.CURSOR)
+        with open(path + '.tmp', 'w') as cursor_file:
+            cursor_file.write('%d %d\n' % (self.read_segment, self.read_offset))
+        os.replace(path + '.tmp', path)
+
+    def _open(self, segment):
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self._path(segment), 'ab')
+        self.write_segment = segment
+        self.sizes.setdefault(segment, 0)
+
+    def _delete(self, segment):
+        try:
+            os.remove(self._path(segment))
+        except FileNotFoundError:
+            pass
+        self.total -= self.sizes.pop(segment)
+
+    # Number of bytes not yet committed by the reader.
+    def pending(self):
+        with self.lock:
+            return self.total - self.read_offset
+
+    # Appends a record. Only writes to the OS's buffers; nothing is synced to disk.
+    def append(self, record):
+        frame = self.FRAME.pack(len(record), zlib.crc32(record)) + record
+        with self.lock:
+            if self.sizes[self.write_segment] and self.sizes[self.write_segment] + len(frame) > self.segment_size:
+                self._open(self.write_segment + 1)
+            self._file.write(frame)
+            self.sizes[self.write_segment] += len(frame)
+            self.total += len(frame)
+            while self.total > self.max_bytes and len(self.sizes) > 1:
+                oldest = min(self.sizes)
+                dropped = self.sizes[oldest] - (self.read_offset if oldest == self.read_segment else 0)
+                self.dropped_bytes += dropped
+                logger.warning("Spool %s is full, discarding %d bytes of the oldest records", self.directory, dropped)
+                self._delete(oldest)
+                if oldest == self.read_segment:
+                    self.read_segment, self.read_offset = min(self.sizes), 0
+
+    # Returns up to count records from the reader's position, and the position after them to pass to commit.
+    def read(self, count):
+        records = []
+        with self.lock:
+            self._file.flush()
+            segment, offset = self.read_segment, self.read_offset
+            while len(records) < count and segment in self.sizes:
+                size = self.sizes[segment]
+                if offset < size:
+                    with open(self._path(segment), 'rb') as segment_file:
+                        segment_file.seek(offset)
+                        offset = self._readFrames(segment_file, segment, offset, size, count - len(records), records)
+                if offset < size or segment == self.write_segment:
+                    break
+                segment, offset = segment + 1, 0
+        return records, (segment, offset)
+
+    # Reads up to count frames from a segment file into records. Returns the offset after the last one read.
+    # A torn or corrupt frame skips the rest of the segment.
+    def _readFrames(self, segment_file, segment, offset, size, count, records):
+        while count and offset < size:
+            header = segment_file.read(self.FRAME.size)
+            if len(header) == self.FRAME.size:
+                length, crc = self.FRAME.unpack(header)
+                record = segment_file.read(length)
+                if len(record) == length and zlib.crc32(record) == crc:
+                    records.append(record)
+                    offset += self.FRAME.size + length
+                    count -= 1
+                    continue
+            logger.warning("Skipping a corrupt record at %d in %s", offset, self._path(segment))
+            return size
+        return offset
+
+    # Marks every record before position, as returned by read, as done. Deletes the segments it has passed.
+    def commit(self, position):
+        segment, offset = position
+        with self.lock:
+            if segment < self.read_segment:
+                # The segment was discarded while its records were being shipped.
+                return
+            for old in [old for old in self.sizes if old < segment]:
+                self._delete(old)
+            self.read_segment, self.read_offset = segment, offset
+            self._saveCursor()
+
+    def close(self):
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._saveCursor()
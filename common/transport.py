@@ -0,0 +1,596 @@
+import logging
+import os
+import time
+import numpy as np
+from common import wire
+
+# logging
+logger = logging.getLogger(__name__)
+
+# Number of sequenced commands the controller may have in flight to the robot.
+DEFAULT_WINDOW = 4
+
+
+# Interface for passing vectors between the controller, robot and sensor.
+# A channel carries messages from one producer to one consumer, e.g. 'Controller.Robot'.
+# Messages are wire.RECORD records; get, take and put deal with just their xyz vector.
+class Transport:
+    def __init__(self):
+        # Next sequence number for each channel this process publishes on.
+        self.seqs = {}
+
+        # common.metrics.Metrics that backends record their call latencies in, if set.
+        self.metrics = None
+
+        # Number of round trips to the server so far. Always 0 for backends without a server.
+        self.ops = 0
+        self.tick_ops = 0
+
+    # Returns the next sequence number for a channel.
+    def nextSeq(self, channel):
+        seq = self.seqs.get(channel, 0)
+        self.seqs[channel] = seq + 1
+        return seq
+
+    # Returns the channel that carries message seq of a window of sequenced messages.
+    # Each of the window's messages gets its own key so that none is overwritten before it is read.
+    def windowSlot(self, channel, seq, window):
+        return '%s.w%d' % (channel, seq % window)
+
+    # Returns the vector of the oldest unread message on the channel without consuming it, or None if there is none.
+    # The vector may be read-only.
+    def get(self, channel):
+        record = self.getRecord(channel)
+        return None if record is None else record['xyz']
+
+    # Returns the vector of the oldest unread message on the channel and consumes it, or None if there is none.
+    # The vector may be read-only.
+    def take(self, channel):
+        record = self.takeRecord(channel)
+        return None if record is None else record['xyz']
+
+    # Publishes a vector on the channel.
+    # @param ttl Seconds after which an unread message may expire. 0 means never. Not every backend supports it.
+    # @param seq Sequence number to stamp the message with. Defaults to the channel's next sequence number.
+    def put(self, channel, vector, ttl=0, seq=None):
+        records = wire.makeRecords(1)
+        records['seq'] = self.nextSeq(channel) if seq is None else seq
+        records['ts'] = time.monotonic_ns()
+        records['xyz'] = vector
+        return self.putBatch(channel, records, ttl=ttl)
+
+    # Returns the oldest unread record on the channel without consuming it, or None if there is none.
+    def getRecord(self, channel):
+        raise NotImplementedError
+
+    # Returns the oldest unread record on the channel and consumes it, or None if there is none.
+    def takeRecord(self, channel):
+        raise NotImplementedError
+
+    # Publishes an array of wire.RECORD on the channel.
+    def putBatch(self, channel, records, ttl=0):
+        raise NotImplementedError
+
+    # Returns every unread record on the channel as an array of wire.RECORD and consumes them,
+    # or None if there are none.
+    def takeBatch(self, channel):
+        raise NotImplementedError
+
+    # Publishes an array of wire.RECORD on the channel only if it has no message, atomically.
+    # Returns True if it was published. Only for backends that can be shared by any number of processes.
+    def addBatch(self, channel, records, ttl=0):
+        raise NotImplementedError
+
+    # Returns every unread record on each channel without consuming them, as a dict of channel to array of
+    # wire.RECORD for the channels that had any. Only for backends that can be shared by any number of processes.
+    def getBatches(self, channels):
+        raise NotImplementedError
+
+    # Takes the oldest unread record from each channel. Returns a dict of channel to record for the channels
+    # that had one.
+    def takeMany(self, channels):
+        records = {}
+        for channel in channels:
+            record = self.takeRecord(channel)
+            if record is not None:
+                records[channel] = record
+        return records
+
+    # Takes every unread record from each channel. Returns a dict of channel to array of wire.RECORD for the
+    # channels that had any. Backends may read all the channels at once and clear them after, losing any message
+    # published in between, so it is only for channels whose producer never overwrites an unread message, such as
+    # window slots. Channels whose messages are each superseded by the next are read with readBatches.
+    def takeBatches(self, channels):
+        batches = {}
+        for channel in channels:
+            records = self.takeBatch(channel)
+            if records is not None:
+                batches[channel] = records
+        return batches
+
+    # Takes every unread record from each channel of take, like takeBatches, and reads the latest message on each
+    # channel of latest, whose messages are each superseded by the next, such as acknowledgements. Returns a dict
+    # of channel to array of wire.RECORD for the channels that had any. Backends that cannot take a message
+    # atomically leave the latest messages in place, so readers must skip the ones they have already seen.
+    def readBatches(self, take=(), latest=()):
+        return self.takeBatches(list(take) + list(latest))
+
+    # Publishes a dict of channel to array of wire.RECORD.
+    def putMany(self, batches, ttl=0):
+        published = True
+        for channel, records in batches.items():
+            published = self.putBatch(channel, records, ttl=ttl) and published
+        return published
+
+    # Discards any unread messages on the channel.
+    def discard(self, channel):
+        raise NotImplementedError
+
+    # Discards any unread messages on each channel.
+    def discardMany(self, channels):
+        for channel in channels:
+            self.discard(channel)
+
+    # Discards every unread message this transport can reach.
+    def flush(self):
+        raise NotImplementedError
+
+    # Ends a tick of the calling component. Returns the number of round trips made since the previous call,
+    # and records it in metrics as ops_per_tick if set.
+    def endTick(self):
+        ops = self.ops - self.tick_ops
+        self.tick_ops = self.ops
+        if self.metrics is not None:
+            self.metrics.observeCount('ops_per_tick', ops)
+        return ops
+
+    # Releases any resources held by the transport.
+    def close(self):
+        pass
+
+
+# Transport over memcached. Each channel is a single key holding one wire format message, so a message
+# that is not read before the next one is published is overwritten. A batch is stored as one message.
+# Taking a message replaces it with an empty value using check-and-set, so a message published between
+# the read and the clear is never lost; an empty value reads as no message.
+class MemcachedTransport(Transport):
+    # Number of times a take is retried when the producer keeps overwriting the message being taken.
+    CAS_RETRIES = 10
+
+    # @param servers memcached servers as 'host' or 'host:port'. Keys are spread over them by consistent hashing.
+    def __init__(self, servers=('localhost',)):
+        import pylibmc
+
+        super().__init__()
+
+        # client for connecting to memcached.
+        self.memcache_client = pylibmc.Client(list(servers), binary=True,
+                                              behaviors={"tcp_nodelay": True, "ketama": True, "cas": True})
+
+    # Calls a pylibmc client method, recording its latency as memcached.<method> if metrics are set.
+    # Every call is one round trip.
+    def call(self, method, *args, **kwargs):
+        self.ops += 1
+        if self.metrics is None:
+            return getattr(self.memcache_client, method)(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return getattr(self.memcache_client, method)(*args, **kwargs)
+        finally:
+            self.metrics.observe('memcached.' + method, time.perf_counter() - start)
+
+    # Decodes a value read from memcached. Values that are not in the wire format are ignored.
+    def decode(self, channel, value):
+        if not value:
+            return None
+        try:
+            records = wire.decode(value)
+        except (TypeError, wire.WireFormatError) as exception:
+            logger.warning("Ignoring message on %s: %s", channel, exception)
+            return None
+        return records if len(records) else None
+
+    def getRecord(self, channel):
+        records = self.decode(channel, self.call('get', channel))
+        return None if records is None else records[0]
+
+    def takeRecord(self, channel):
+        records = self.takeBatch(channel)
+        return None if records is None else records[0]
+
+    def putBatch(self, channel, records, ttl=0):
+        self.call('set', channel, wire.encodeBatch(records), time=ttl)
+        return True
+
+    # Reads the message with gets and clears it with cas, which fails if it was overwritten after the read.
+    # The newer message is then taken instead. Two round trips if there is a message, one if not.
+    def takeBatch(self, channel):
+        for _ in range(self.CAS_RETRIES):
+            value, cas = self.call('gets', channel)
+            if not value:
+                return None
+            if self.call('cas', channel, b'', cas):
+                return self.decode(channel, value)
+        logger.warning("Could not take the message on %s: it keeps being overwritten", channel)
+        return None
+
+    def addBatch(self, channel, records, ttl=0):
+        return bool(self.call('add', channel, wire.encodeBatch(records), time=ttl))
+
+    # Reads every channel with one get_multi.
+    def getBatches(self, channels):
+        batches = {}
+        for channel, value in self.call('get_multi', list(channels)).items():
+            decoded = self.decode(channel, value)
+            if decoded is not None:
+                batches[channel] = decoded
+        return batches
+
+    # Reads every channel with one get_multi and deletes the ones found with one delete_multi.
+    # A message published between the two is deleted unread.
+    def takeBatches(self, channels):
+        return self.readBatches(take=channels)
+
+    # Reads every channel with one get_multi and deletes the ones of take found with one delete_multi.
+    # The latest messages are left in place, since deleting them could delete a newer one unread.
+    def readBatches(self, take=(), latest=()):
+        values = {channel: value for channel, value in self.call('get_multi', list(take) + list(latest)).items()
+                  if value}
+        taken = [channel for channel in take if channel in values]
+        if taken:
+            self.call('delete_multi', taken)
+        batches = {}
+        for channel, value in values.items():
+            decoded = self.decode(channel, value)
+            if decoded is not None:
+                batches[channel] = decoded
+        return batches
+
+    def takeMany(self, channels):
+        return {channel: records[0] for channel, records in self.takeBatches(channels).items()}
+
+    # Publishes every channel with one set_multi.
+    def putMany(self, batches, ttl=0):
+        failed = self.call('set_multi', {channel: wire.encodeBatch(records) for channel, records in batches.items()},
+                           time=ttl)
+        return not failed
+
+    def discard(self, channel):
+        self.call('delete', channel)
+
+    def discardMany(self, channels):
+        self.call('delete_multi', list(channels))
+
+    def flush(self):
+        self.call('flush_all')
+
+
+# In-process stand-in for memcached, for running the controller, robot and sensor in one process, e.g. in
+# ./bench/replay.py. Each channel holds one wire format message that the next put overwrites, as with memcached.
+# Expiry follows clock, which returns seconds and may be simulated.
+# ops counts the round trips MemcachedTransport would make for the same calls.
+class MemoryTransport(Transport):
+    def __init__(self, clock=time.monotonic):
+        super().__init__()
+        self.clock = clock
+
+        # Channel to (expiry time or None, encoded message).
+        self.values = {}
+
+        # Number of messages published on each channel.
+        self.puts = {}
+
+    # Returns the encoded message on the channel, dropping it if it has expired.
+    def value(self, channel):
+        entry = self.values.get(channel)
+        if entry is None:
+            return None
+        expiry, value = entry
+        if expiry is not None and self.clock() >= expiry:
+            del self.values[channel]
+            return None
+        return value
+
+    def getRecord(self, channel):
+        self.ops += 1
+        value = self.value(channel)
+        return None if value is None else wire.decode(value)[0]
+
+    def takeRecord(self, channel):
+        records = self.takeBatch(channel)
+        return None if records is None else records[0]
+
+    def putBatch(self, channel, records, ttl=0):
+        self.ops += 1
+        self.store(channel, records, ttl)
+        return True
+
+    def store(self, channel, records, ttl):
+        self.values[channel] = (self.clock() + ttl if ttl else None, wire.encodeBatch(records))
+        self.puts[channel] = self.puts.get(channel, 0) + 1
+
+    def takeBatch(self, channel):
+        self.ops += 1
+        value = self.value(channel)
+        if value is None:
+            return None
+        self.ops += 1
+        del self.values[channel]
+        return wire.decode(value)
+
+    def addBatch(self, channel, records, ttl=0):
+        self.ops += 1
+        if self.value(channel) is not None:
+            return False
+        self.store(channel, records, ttl)
+        return True
+
+    def getBatches(self, channels):
+        self.ops += 1
+        batches = {}
+        for channel in channels:
+            value = self.value(channel)
+            if value is not None:
+                batches[channel] = wire.decode(value)
+        return batches
+
+    def takeBatches(self, channels):
+        return self.readBatches(take=channels)
+
+    # Leaves the latest messages in place, like MemcachedTransport.
+    def readBatches(self, take=(), latest=()):
+        self.ops += 1
+        batches = {}
+        taken = False
+        for channel in take:
+            value = self.value(channel)
+            if value is not None:
+                del self.values[channel]
+                batches[channel] = wire.decode(value)
+                taken = True
+        for channel in latest:
+            value = self.value(channel)
+            if value is not None:
+                batches[channel] = wire.decode(value)
+        if taken:
+            self.ops += 1
+        return batches
+
+    def takeMany(self, channels):
+        return {channel: records[0] for channel, records in self.takeBatches(channels).items()}
+
+    def putMany(self, batches, ttl=0):
+        self.ops += 1
+        for channel, records in batches.items():
+            self.store(channel, records, ttl)
+        return True
+
+    def discard(self, channel):
+        self.ops += 1
+        self.values.pop(channel, None)
+
+    def discardMany(self, channels):
+        self.ops += 1
+        for channel in channels:
+            self.values.pop(channel, None)
+
+    def flush(self):
+        self.ops += 1
+        self.values.clear()
+
+
+# Single-producer single-consumer ring buffer of wire.RECORD in shared memory.
+# Only for processes on the same host. The layout is
+#   [0:8]     head, the number of slots written (owned by the producer)
+#   [64:72]   tail, the number of slots read (owned by the consumer)
+#   [72:80]   ring sequence number of the last slot read (owned by the consumer)
+#   [128:]    capacity slots of (uint64 ring sequence number, wire.RECORD)
+# Each index is only written by one side, so no locks are needed. A slot is written before head is
+# advanced past it, which relies on the platform not reordering stores (true on x86).
+# The ring sequence number counts every push, including dropped ones, so the consumer can detect loss
+# independently of the record's own sequence number.
+class SharedMemoryRing:
+    HEADER_SIZE = 128
+    SLOT = np.dtype([('n', '<u8'), ('record', wire.RECORD)])
+
+    def __init__(self, name, capacity=1024):
+        # Ring size. A power of two so indexes wrap with a mask.
+        if capacity <= 0 or capacity & (capacity - 1):
+            raise ValueError("capacity must be a power of two, not %r" % capacity)
+        self.capacity = capacity
+
+        self.shm = self._open(name, self.HEADER_SIZE + capacity * self.SLOT.itemsize)
+        self.producer = np.ndarray((2,), dtype='<u8', buffer=self.shm.buf, offset=0)
+        self.consumer = np.ndarray((2,), dtype='<u8', buffer=self.shm.buf, offset=64)
+        self.slots = np.ndarray((capacity,), dtype=self.SLOT, buffer=self.shm.buf, offset=self.HEADER_SIZE)
+
+        # Number of records this process failed to publish because the ring was full.
+        self.dropped = 0
+
+        # Number of records this process found missing from the sequence when reading.
+        self.lost = 0
+
+    # Creates the segment, or attaches to it if another process already has.
+    # New segments are zero-filled, which is a valid empty ring.
+    @staticmethod
+    def _open(name, size):
+        from multiprocessing import shared_memory
+
+        for _ in range(100):
+            try:
+                shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            except FileExistsError:
+                try:
+                    shm = shared_memory.SharedMemory(name=name)
+                except ValueError:
+                    # The creator has not sized the segment yet.
+                    time.sleep(0.001)
+                    continue
+            # The segment outlives this process, like a memcached key, so stop the resource tracker unlinking it.
+            try:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(shm._name, 'shared_memory')
+            except Exception:
+                pass
+            if shm.size < size:
+                raise ValueError("shared memory segment %s is smaller than expected" % name)
+            return shm
+        raise TimeoutError("shared memory segment %s was never sized" % name)
+
+    # Returns the number of unread records.
+    def __len__(self):
+        return int(self.producer[0] - self.consumer[0])
+
+    # Appends a record. Returns False and counts it as dropped if the ring is full; the consumer will
+    # see the gap in ring sequence numbers.
+    def push(self, record):
+        head = int(self.producer[0])
+        n = int(self.producer[1])
+        self.producer[1] = n + 1
+        if head - int(self.consumer[0]) >= self.capacity:
+            self.dropped += 1
+            return False
+        slot = self.slots[head & (self.capacity - 1)]
+        slot['n'] = n
+        slot['record'] = record
+        self.producer[0] = head + 1
+        return True
+
+    # Returns a copy of the oldest unread record without consuming it, or None if the ring is empty.
+    def peek(self):
+        tail = int(self.consumer[0])
+        if tail == int(self.producer[0]):
+            return None
+        return self.slots['record'][tail & (self.capacity - 1)].copy()
+
+    # Returns a copy of the oldest unread record and consumes it, or None if the ring is empty.
+    def pop(self):
+        tail = int(self.consumer[0])
+        if tail == int(self.producer[0]):
+            return None
+        slot = self.slots[tail & (self.capacity - 1)].copy()
+        n = int(slot['n'])
+        last = int(self.consumer[1])
+        if tail and n > last + 1:
+            self.lost += n - last - 1
+            logger.warning("Lost %d messages on %s", n - last - 1, self.shm.name)
+        self.consumer[1] = n
+        self.consumer[0] = tail + 1
+        return slot['record']
+
+    # Consumes every unread record. Records that were cleared are not counted as lost.
+    def clear(self):
+        pushed = int(self.producer[1])
+        if pushed:
+            self.consumer[1] = pushed - 1
+        self.consumer[0] = self.producer[0]
+
+    def close(self):
+        self.producer = self.consumer = self.slots = None
+        self.shm.close()
+
+    # Removes the segment from the system. Processes still attached keep working until they close it.
+    def unlink(self):
+        # SharedMemory.unlink also unregisters the segment, so register it again to keep the tracker consistent.
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.register(self.shm._name, 'shared_memory')
+        except Exception:
+            pass
+        self.shm.unlink()
+
+
+# Transport over shared-memory ring buffers, one per channel, for co-located processes.
+# Messages are queued rather than overwritten, and lost messages are detected by sequence number.
+# Records are copied in and out of the ring, never pickled. ttl is ignored.
+class SharedMemoryTransport(Transport):
+    # Directory the system keeps shared memory segments in, where there is one.
+    SHM_DIR = '/dev/shm'
+
+    def __init__(self, prefix='rcs', capacity=1024):
+        super().__init__()
+        self.prefix = prefix
+        self.capacity = capacity
+        self.rings = {}
+
+    # Returns the ring for a channel, attaching to it on first use.
+    def ring(self, channel):
+        ring = self.rings.get(channel)
+        if ring is None:
+            name = '%s.%s' % (self.prefix, channel)
+            ring = self.rings[channel] = SharedMemoryRing(name, capacity=self.capacity)
+        return ring
+
+    # A ring already delivers messages in order without overwriting them, so a window shares one ring.
+    def windowSlot(self, channel, seq, window):
+        return channel
+
+    def getRecord(self, channel):
+        return self.ring(channel).peek()
+
+    def takeRecord(self, channel):
+        return self.ring(channel).pop()
+
+    def putBatch(self, channel, records, ttl=0):
+        ring = self.ring(channel)
+        published = True
+        for record in records:
+            published = ring.push(record) and published
+        return published
+
+    def takeBatch(self, channel):
+        ring = self.ring(channel)
+        count = len(ring)
+        if not count:
+            return None
+        records = wire.makeRecords(count)
+        for i in range(count):
+            records[i] = ring.pop()
+        return records
+
+    def discard(self, channel):
+        self.ring(channel).clear()
+
+    # Discards unread messages on every channel with this transport's prefix, including ones this process has not
+    # used yet, e.g. left over from an earlier run. Without a SHM_DIR, only the channels this process has used.
+    def flush(self):
+        if os.path.isdir(self.SHM_DIR):
+            for name in os.listdir(self.SHM_DIR):
+                if name.startswith(self.prefix + '.'):
+                    try:
+                        self.ring(name[len(self.prefix) + 1:])
+                    except ValueError as exception:
+                        logger.warning("Not flushing %s: %s", name, exception)
+        for ring in self.rings.values():
+            ring.clear()
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+        self.rings = {}
+
+
+# Returns the channel for a robot. Channels are shared by every robot if robot_id is None.
+def robotChannel(channel, robot_id=None):
+    if robot_id is None:
+        return channel
+    return '%s.%s' % (channel, robot_id)
+
+
+# Adds the command line arguments for choosing a transport.
+def addTransportArguments(parser):
+    parser.add_argument('--transport', choices=['memcached', 'shm'], default='memcached',
+                        help='Pass messages through memcached or through shared memory on this host')
+    parser.add_argument('--servers', default='localhost',
+                        help='Comma-separated memcached servers as host or host:port. Keys are spread over them by '
+                             'consistent hashing. Must match across components')
+    parser.add_argument('--shmprefix', default='rcs', help='Name prefix for shared memory ring buffers')
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW,
+                        help='Number of commands the controller may have in flight. Must match across components')
+
+
+# Creates the transport chosen on the command line.
+def createTransport(args):
+    if args.transport == 'shm':
+        return SharedMemoryTransport(prefix=args.shmprefix)
+    return MemcachedTransport(servers=args.servers.split(','))
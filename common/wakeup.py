@@ -0,0 +1,81 @@
+import logging
+import select
+import socket
+import sys
+from common.transport import robotChannel
+
+# logging
+logger = logging.getLogger(__name__)
+
+# Prefix of the wake-up socket names, which share the Linux abstract socket namespace with every other program.
+PREFIX = 'rcs.wakeup.'
+
+
+# Returns the name a component listens for wake-ups on, e.g. 'robot' or 'robot.3' for robot 3 of a fleet.
+def wakeupName(component, robot_id=None):
+    return robotChannel(component, robot_id)
+
+
+# Wakes idle components on the same host as soon as a message is published for them, so they need not poll fast
+# to respond fast. Each listening component binds a datagram socket in the Linux abstract namespace, which
+# disappears with the process, and a publisher sends it an empty datagram after publishing.
+# Wake-ups are hints: the message itself is still read from the transport, and a wake-up to a component that is
+# not listening, e.g. on another host, is dropped, leaving it to find the message on its next poll.
+class WakeUp:
+    # @param name Name to listen on, or None to only wake others.
+    def __init__(self, name=None):
+        self.name = name
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+
+        # True if wake-ups sent to name reach this process.
+        self.listening = False
+        if name is not None:
+            if not sys.platform.startswith('linux'):
+                logger.warning("Wake-ups need Linux abstract sockets, polling instead")
+            else:
+                try:
+                    self.socket.bind(self.address(name))
+                    self.listening = True
+                except OSError as exception:
+                    # e.g. another process of the same name on this host.
+                    logger.warning("Could not listen for wake-ups as %s, polling instead: %s", name, exception)
+
+    @staticmethod
+    def address(name):
+        return '\0' + PREFIX + name
+
+    # Wakes the components listening on each name.
+    def notify(self, *names):
+        for name in names:
+            try:
+                self.socket.sendto(b'', self.address(name))
+            except OSError:
+                # Nobody listening, or so many wake-ups pending that another would add nothing.
+                pass
+
+    # Wakes this process's own wait, e.g. so it notices it has been stopped.
+    def wake(self):
+        if self.listening:
+            self.notify(self.name)
+
+    # Waits up to timeout seconds for a wake-up, and consumes every pending one. Returns True if woken.
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.socket], [], [], max(timeout, 0.0))
+        if not readable:
+            return False
+        while True:
+            try:
+                self.socket.recv(1)
+            except BlockingIOError:
+                return True
+
+    def close(self):
+        self.socket.close()
+
+
+# Creates the WakeUp a component listens on, unless --nowakeup is given.
+def createWakeUp(args, component, robot_id=None):
+    if args.nowakeup:
+        return None
+    return WakeUp(wakeupName(component, robot_id))
@@ -0,0 +1,68 @@
+import struct
+import time
+import numpy as np
+
+# Binary format for vectors exchanged by the controller, robot and sensor.
+# A message is an 8 byte header followed by count records:
+#   header  2s magic b'RV', uint8 version, uint8 reserved, uint32 count (little endian)
+#   record  uint64 seq, int64 ts, float64 xyz[3] (little endian, 40 bytes)
+# ts is time.monotonic_ns() when the record was created, so it is only comparable between processes on the same host.
+MAGIC = b'RV'
+VERSION = 1
+HEADER = struct.Struct('<2sBBI')
+RECORD = np.dtype([('seq', '<u8'), ('ts', '<i8'), ('xyz', '<f8', (3,))])
+
+
+# Raised when a message is not in this format.
+class WireFormatError(ValueError):
+    pass
+
+
+# Allocates n zeroed records.
+def makeRecords(n):
+    return np.zeros(n, dtype=RECORD)
+
+
+# Encodes a single vector as a message.
+# @param ts Defaults to the current monotonic time.
+def encode(xyz, seq=0, ts=None):
+    records = makeRecords(1)
+    records['seq'] = seq
+    records['ts'] = time.monotonic_ns() if ts is None else ts
+    records['xyz'] = xyz
+    return encodeBatch(records)
+
+
+# Encodes an array of RECORD as one message.
+def encodeBatch(records):
+    return HEADER.pack(MAGIC, VERSION, 0, len(records)) + np.ascontiguousarray(records, dtype=RECORD).tobytes()
+
+
+# Decodes a message into an array of RECORD without copying.
+# The result is a read-only view of buf; copy it before modifying it.
+def decode(buf):
+    if len(buf) < HEADER.size:
+        raise WireFormatError("message is %d bytes, shorter than the header" % len(buf))
+    magic, version, _, count = HEADER.unpack_from(buf)
+    if magic != MAGIC:
+        raise WireFormatError("bad magic %r" % magic)
+    if version != VERSION:
+        raise WireFormatError("unsupported version %d" % version)
+    if len(buf) != HEADER.size + count * RECORD.itemsize:
+        raise WireFormatError("message is %d bytes, expected %d records" % (len(buf), count))
+    return np.frombuffer(buf, dtype=RECORD, count=count, offset=HEADER.size)
+
+
+# Returns value as a float64 vector with one value per axis. A scalar applies to every axis.
+def axisVector(value):
+    vector = np.asarray(value, dtype=np.float64).reshape(-1)
+    if len(vector) == 1:
+        return np.repeat(vector, 3)
+    if len(vector) != 3:
+        raise ValueError("expected 1 or 3 values, not %d" % len(vector))
+    return vector.copy()
+
+
+# Parses a command line value of one number for every axis, or three comma-separated numbers, e.g. "0,1,0".
+def parseAxes(text):
+    return axisVector([float(value) for value in text.split(',')])
@@ -0,0 +1,5 @@
+from controller.controller import main
+
+# Runs the controller with "python3 -m controller".
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import itertools
+import os
+import numpy as np
+
+
+# Commands held in one contiguous (n, 3) float64 array, consumed from the front by moving a cursor.
+# Replaces a deque of per-row arrays: popleft returns a view of the next row and never copies.
+class CommandBuffer:
+    def __init__(self, array=None):
+        self.array = np.empty((0, 3)) if array is None else array
+
+        # Index of the next command to send.
+        self.cursor = 0
+
+    # Number of commands not yet consumed.
+    def __len__(self):
+        return len(self.array) - self.cursor
+
+    def __bool__(self):
+        return self.cursor < len(self.array)
+
+    # Returns the next command and advances the cursor. Raises IndexError if there are none left.
+    def popleft(self):
+        if self.cursor >= len(self.array):
+            raise IndexError("no commands left")
+        vector = self.array[self.cursor]
+        self.cursor += 1
+        return vector
+
+    # Consumes up to count commands without returning them. Returns the number consumed.
+    def skip(self, count):
+        skipped = min(count, len(self))
+        self.cursor += skipped
+        return skipped
+
+
+# Checks that an array holds one 3-dimension command per row and returns it as float64.
+def checkCommands(array, path):
+    if array.ndim != 2 or array.shape[1] != 3:
+        raise ValueError("%s: expected rows of 3 values, got shape %s" % (path, array.shape))
+    if array.dtype != np.float64:
+        array = array.astype(np.float64)
+    return array
+
+
+# Reads a CSV file with a header line and rows of x,y,z.
+# Reads chunk_rows lines at a time and parses each chunk in one call into a growing contiguous buffer.
+def readCsv(path, chunk_rows=65536):
+    buffer = np.empty((chunk_rows, 3))
+    count = 0
+    with open(path) as csv_file:
+        csv_file.readline()
+        while True:
+            lines = [line.strip() for line in itertools.islice(csv_file, chunk_rows)]
+            if not lines:
+                break
+            lines = [line for line in lines if line]
+            values = np.fromstring(','.join(lines), sep=',')
+            if values.size != 3 * len(lines):
+                raise ValueError("%s: expected rows of 3 numbers after line %d" % (path, count + 1))
+            if count + len(lines) > len(buffer):
+                buffer = np.resize(buffer, (max(2 * len(buffer), count + len(lines)), 3))
+            buffer[count:count + len(lines)] = values.reshape(-1, 3)
+            count += len(lines)
+    return buffer[:count].copy() if count < len(buffer) else buffer
+
+
+# Loads commands from a file into a CommandBuffer.
+# .npy files and raw little-endian float64 files (.bin, .f64) are memory-mapped rather than read,
+# anything else is read as CSV.
+def loadCommands(path, chunk_rows=65536):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npy':
+        array = np.load(path, mmap_mode='r')
+    elif extension in ('.bin', '.f64'):
+        array = np.memmap(path, dtype='<f8', mode='r')
+        if array.size % 3:
+            raise ValueError("%s: %d values is not a whole number of commands" % (path, array.size))
+        array = array.reshape(-1, 3)
+    else:
+        array = readCsv(path, chunk_rows)
+    return CommandBuffer(checkCommands(array, path))
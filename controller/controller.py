@@ -1,16 +1,22 @@
 import numpy as np
-import pylibmc
-import tkinter as tk
 import argparse
 import logging
 import sys
-from collections import deque
+import threading
+import time
+from common import wire
+from common.metrics import Metrics, addMetricsArguments, startMetrics
+from common.ready import notifyReady
+from common.scheduler import AdaptiveScheduler, addSchedulerArguments
+from common.wakeup import createWakeUp, wakeupName
+from controller.command_loader import CommandBuffer, loadCommands
+from common.transport import DEFAULT_WINDOW, MemcachedTransport, robotChannel, addTransportArguments, createTransport
 
-# keys for memcached
+# channels for the transport
 keyControllerToRobot = 'Controller.Robot'
-keyControllerToRobotCorrect = 'Controller.Correct'
 keyControllerToSensor = 'Controller.Sensor'
 keySensorToController = 'Sensor.Controller'
+keyRobotToController = 'Robot.Controller'
 
 # logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -18,57 +24,213 @@ logger = logging.getLogger(__name__)
 
 
 class Controller:
-    def __init__(self, data="", verbose=True):
+    # Number of recent commands whose send times and corrections are remembered.
+    HISTORY = 4096
+
+    def __init__(self, data="", verbose=True, transport=None, robot_id=None, chunk_rows=65536, window=DEFAULT_WINDOW,
+                 metrics=None, max_correction=1.0, wakeup=None):
         # Structure for queueing commands that will be sent to the robot.
-        # Commands are a 3-dimension numpy array.
-        self.commands = deque()
+        # Commands are the rows of one (n, 3) numpy array.
+        self.commands = CommandBuffer()
+
+        # Transport for communicating with the robot and sensor. Defaults to memcached.
+        self.transport = transport if transport is not None else MemcachedTransport()
+
+        # ID the robot is addressed by in channel names. None uses the channels shared by every robot.
+        self.robot_id = robot_id
+        self.channels = {key: robotChannel(key, robot_id)
+                         for key in (keyControllerToRobot, keyControllerToSensor, keySensorToController,
+                                     keyRobotToController)}
+
+        # Number of commands that may be sent before the robot acknowledges them.
+        self.window = window
+
+        # Sequence number of the next command. Commands are numbered from 1.
+        self.next_seq = 1
+
+        # Highest sequence number the robot has acknowledged receiving.
+        self.acked_seq = 0
+
+        # Correction waiting to be added to the next command, if has_pending_correction is set.
+        self.pending_correction = np.zeros(3)
+        self.has_pending_correction = False
 
-        # client for connecting to memcached.
-        self.memcache_client = pylibmc.Client(['localhost'], binary=True, behaviors={"tcp_nodelay": True, "ketama": True})
+        # Sum of every correction sent so far, and what it was after each recent command, indexed by sequence number
+        # modulo HISTORY. The difference is the sum of the corrections carried by the commands after that one.
+        self.correction_total = np.zeros(3)
+        self.correction_totals = np.zeros((self.HISTORY, 3))
 
-        # Controller will not correct for over this amount in one command.
-        self.max_correction_bound = 1.0
+        # Sequence number of the command after which the sensor made its latest observation.
+        self.observed_seq = 0
 
-        # CSV file to read in.
+        # Latency histograms. The transport records its own latencies here too unless it already has metrics.
+        self.metrics = metrics if metrics is not None else Metrics('controller')
+        if self.transport.metrics is None:
+            self.transport.metrics = self.metrics
+
+        # Monotonic time each recent command was sent, indexed by sequence number modulo HISTORY.
+        self.sent_times = np.zeros(self.HISTORY, dtype=np.int64)
+
+        # Controller will not correct for over this amount on each axis in one command. A scalar applies to every axis.
+        self.max_correction_bound = wire.axisVector(max_correction)
+        self.min_correction_bound = -self.max_correction_bound
+
+        # Buffers a tick's messages to the robot and sensor are built in. A sensor message may carry a correction.
+        self.robot_records = wire.makeRecords((window, 1))
+        self.sensor_records = wire.makeRecords((window, 2))
+
+        # CSV, .npy or raw float64 file to read in.
         self.data = data
 
+        # Number of CSV lines parsed at a time.
+        self.chunk_rows = chunk_rows
+
         # Verbose logging.
         self.verbose = verbose
 
-    # Pops first data in queue and sends it to the robot using the keyControllerToRobot key.
-    # Also sends data to the sensor to calculate robot's expected location.
+        # common.wakeup.WakeUp the robot and sensor are woken with once commands are sent to them, if set.
+        self.wakeup = wakeup
+        self.wakeup_names = (wakeupName('robot', robot_id), wakeupName('sensor', robot_id))
+
+    # Reads the latest messages from the robot and the sensor in one readBatches.
+    # Both are superseded by the next one and may be read again, so only acknowledgements and corrections of
+    # commands after the ones already seen are used.
+    # Returns True if there were any new ones.
+    def receiveMessages(self):
+        acked_seq, observed_seq = self.acked_seq, self.observed_seq
+        batches = self.transport.readBatches(latest=[self.channels[keyRobotToController],
+                                                     self.channels[keySensorToController]])
+        self.receiveAckFromRobot(batches.get(self.channels[keyRobotToController]))
+        self.correctPath(batches.get(self.channels[keySensorToController]))
+        return self.acked_seq != acked_seq or self.observed_seq != observed_seq
+
+    # Reads the robot's acknowledgement of the last command it applied.
+    # @param acks Records already taken from the robot's channel. If None, they are taken here.
+    def receiveAckFromRobot(self, acks=None):
+        if acks is None:
+            acks = self.transport.takeBatch(self.channels[keyRobotToController])
+        if acks is not None:
+            ack = acks[-1]
+            # An acknowledgement of a command not yet sent is left over from an earlier run of the controller.
+            if self.acked_seq < ack['seq'] < self.next_seq:
+                self.metrics.observeHop('robot_to_controller', ack)
+                self.acked_seq = int(ack['seq'])
+                self.observeSince('command_to_ack', self.acked_seq)
+        return self.acked_seq
+
+    # Continues the mission of an earlier run of the controller, whose robot is still running and would skip
+    # commands numbered from 1 as left over. Command numbers are mission rows counted from 1, so the commands up to
+    # the robot's latest acknowledgement are skipped and the rest are sent on from the robot's current location.
+    # Commands the earlier run sent after that one are sent again with the same numbers, and the robot skips the
+    # ones it already has. Must be called after readData.
+    # Waits up to timeout seconds for an acknowledgement, which an idle robot still repeats every few seconds.
+    # Returns the sequence number of the next command.
+    def resume(self, timeout=3.0, interval=0.05):
+        deadline = time.monotonic() + timeout
+        acks = self.transport.takeBatch(self.channels[keyRobotToController])
+        while acks is None and time.monotonic() < deadline:
+            time.sleep(interval)
+            acks = self.transport.takeBatch(self.channels[keyRobotToController])
+        if acks is None:
+            logger.warning("Controller - No acknowledgement from the robot to resume from, starting the mission over")
+            return self.next_seq
+        ack = int(acks['seq'].max())
+        skipped = self.commands.skip(ack)
+        if skipped < ack:
+            logger.warning("Controller - Robot acknowledged command %d of a mission of %d commands", ack, skipped)
+        self.next_seq = ack + 1
+        # Corrections and acknowledgements of the commands already applied are ignored.
+        self.acked_seq = self.observed_seq = ack
+        logger.info("Controller - Resuming after command %d", ack)
+        return self.next_seq
+
+    # Records the time since a command was sent, if it is recent enough to still be known.
+    def observeSince(self, name, seq):
+        if 0 < seq < self.next_seq and self.next_seq - seq <= self.HISTORY:
+            self.metrics.observe(name, (time.monotonic_ns() - int(self.sent_times[seq % self.HISTORY])) / 1e9)
+
+    # Function to return the number of commands sent but not yet acknowledged by the robot.
+    def commandsInFlight(self):
+        return self.next_seq - 1 - self.acked_seq
+
+    # Pops commands from the queue and sends them to the robot until the window is full.
+    # Each command goes to its own window slot so none is overwritten before the robot reads it.
+    # Also sends the uncorrected command to the sensor to calculate robot's expected location.
+    # A pending correction is added to the first command sent, and sent to the sensor as a second record in
+    # that command's slot. Every message of the tick is published in one putMany.
+    # Returns the number of commands sent.
     def sendDataToRobot(self):
-        if self.memcache_client.get(keyControllerToRobot) is None:
+        batches = {}
+        now = time.monotonic_ns()
+        sent = 0
+        while self.commands and self.commandsInFlight() < self.window:
+            seq = self.next_seq
             vector = self.commands.popleft()
+            robot_records = self.robot_records[sent]
+            sensor_records = self.sensor_records[sent]
+            robot_records['seq'] = sensor_records['seq'] = seq
+            robot_records['ts'] = sensor_records['ts'] = now
+            sensor_records['xyz'][0] = vector
+            command = robot_records['xyz'][0]
+            if self.has_pending_correction:
+                np.add(vector, self.pending_correction, out=command)
+                sensor_records['xyz'][1] = self.pending_correction
+                self.correction_total += self.pending_correction
+                self.has_pending_correction = False
+            else:
+                command[:] = vector
+                sensor_records = sensor_records[:1]
+            self.correction_totals[seq % self.HISTORY] = self.correction_total
             if self.doILog():
-                logstr = "Controller - Sending to robot " + np.array2string(vector)
-                logger.info('%s', logstr)
-            self.memcache_client.set(keyControllerToRobot, vector, time=1000)
-            self.memcache_client.set(keyControllerToSensor, vector, time=1000)
+                logger.info("Controller - Sending to robot %s", command)
+            self.sent_times[seq % self.HISTORY] = now
+            for channel, records in ((keyControllerToSensor, sensor_records), (keyControllerToRobot, robot_records)):
+                slot = self.transport.windowSlot(self.channels[channel], seq, self.window)
+                if slot in batches:
+                    # The whole window shares one channel, e.g. with shared memory.
+                    records = np.concatenate((batches[slot], records))
+                batches[slot] = records
+            self.next_seq += 1
+            sent += 1
+        if batches:
+            self.transport.putMany(batches, ttl=1000)
+            if self.wakeup is not None:
+                self.wakeup.notify(*self.wakeup_names)
+        return sent
 
     # Fetches data from the keySensorToController key.
-    # If data is found, clear the corresponding key in memcache and return the data.
+    # If data is found, consume it from the transport and return the data.
+    # The record holds the error the sensor observed after the command with the record's sequence number.
     def getDataFromSensor(self):
-        vector = self.memcache_client.get(keySensorToController)
-        if vector is not None and type(vector).__module__ == np.__name__:
-            self.memcache_client.delete(keySensorToController)
-        return vector
+        return self.transport.takeRecord(self.channels[keySensorToController])
 
     # Apply a simple correction by subtracting the previous error component if data from sensor is found
     # and apply it to the next move.
-    # Correction amount will not exceed the max_correction_bound.
+    # The sensor's observation does not yet include corrections carried by later commands, so those are
+    # subtracted from the observed error to avoid correcting the same error twice.
+    # Corrections are whole vectors. The amount on each axis will not exceed the max_correction_bound.
     # Note that the robot can error on correctional movements as well.
-    def correctPath(self):
-        correction_data = self.getDataFromSensor()
-        if correction_data is not None:
-            if correction_data[1] > 0:
-                correction_data[1] = min(correction_data[1], self.max_correction_bound)
-            elif correction_data[1] < 0:
-                correction_data[1] = max(correction_data[1], -self.max_correction_bound)
-            if self.doILog():
-                logstr = "Controller - Correcting robot " + np.array2string(correction_data)
-                logger.info('%s', logstr)
-            self.memcache_client.set(keyControllerToRobotCorrect, correction_data)
+    # @param records Records already taken from the sensor's channel. If None, they are taken here.
+    def correctPath(self, records=None):
+        record = self.getDataFromSensor() if records is None else records[-1]
+        if record is None:
+            return
+        seq = int(record['seq'])
+        if seq <= self.observed_seq or seq >= self.next_seq:
+            # Already seen, or about a command from an earlier run of the controller.
+            return
+        self.metrics.observeHop('sensor_to_controller', record)
+        self.observed_seq = seq
+        self.observeSince('command_to_correction', seq)
+        correction = self.pending_correction
+        np.copyto(correction, record['xyz'])
+        if self.next_seq - seq <= self.HISTORY:
+            correction -= self.correction_total
+            correction += self.correction_totals[seq % self.HISTORY]
+        np.clip(correction, self.min_correction_bound, self.max_correction_bound, out=correction)
+        if self.doILog():
+            logger.info("Controller - Correcting robot after command %d %s", seq, correction)
+        self.has_pending_correction = True
 
     # Function to return status of queue.
     def areCommandsAvailable(self):
@@ -79,23 +241,60 @@ class Controller:
     # Function for reading in the specified datafile.
     def readData(self):
         try:
-            arr = np.genfromtxt(self.data, skip_header=1, delimiter=',')
+            self.commands = loadCommands(self.data, chunk_rows=self.chunk_rows)
         except Exception as exception:
             logger.error(exception)
             sys.exit(1)
-        for i in arr:
-            self.commands.append(i)
 
     # Function to output info logging
     def doILog(self):
         return self.verbose
 
 
+# Tkinter gui. An optional front-end over the scheduler, which runs on a background thread.
+def runGui(scheduler, enabled):
+    import tkinter as tk
+
+    controller_gui = tk.Tk()
+    controller_gui.title('Robot Controller')
+    controller_gui.geometry('200x200')
+    loop = tk.BooleanVar(controller_gui)
+    loop.set(True)
+    radiobutton_widget1 = tk.Radiobutton(controller_gui, text="Enable Controller", variable=loop, value=True,
+                                         indicatoron=False, command=enabled.set)
+    radiobutton_widget2 = tk.Radiobutton(controller_gui, text="Disable Controller", variable=loop, value=False,
+                                         indicatoron=False, command=enabled.clear)
+    exit_button = tk.Button(controller_gui, text="Exit", command=controller_gui.destroy)
+
+    radiobutton_widget1.pack()
+    radiobutton_widget2.pack()
+    exit_button.pack()
+
+    scheduler.start()
+    controller_gui.mainloop()
+    scheduler.stop()
+
+
 def main():
     # Code for parsing command line arguments
     parser = argparse.ArgumentParser(description='Controller setup')
-    parser.add_argument('--data', help='File to read')
+    parser.add_argument('--data', help='File to read: CSV with a header line, .npy, or raw float64 (.bin, .f64)')
+    parser.add_argument('--chunksize', type=int, default=65536, help='Number of CSV lines parsed at a time')
     parser.add_argument('--verbose', action='store_true', help='If true, provide verbose output')
+    parser.add_argument('--headless', action='store_true', help='If true, run without the tkinter window')
+    parser.add_argument('--rate', type=float, default=1.0,
+                        help='Number of ticks per second while busy. Each tick sends up to a window of commands')
+    parser.add_argument('--maxcorrection', type=wire.parseAxes, default=1.0,
+                        help='Largest correction added to one command, on every axis or on each axis given as x,y,z')
+    addTransportArguments(parser)
+    addMetricsArguments(parser)
+    addSchedulerArguments(parser)
+    parser.add_argument('--robotid', help='ID of the robot to control, e.g. one robot of a fleet')
+    parser.add_argument('--noflush', action='store_true',
+                        help='If true, keep the messages already in the transport, e.g. when other robots share it')
+    parser.add_argument('--resume', action='store_true',
+                        help='If true, continue the mission after the robot\'s latest acknowledgement, e.g. when '
+                             'restarted while the robot keeps running')
     args = parser.parse_args()
 
     verbose = args.verbose
@@ -105,35 +304,39 @@ def main():
         sys.exit(1)
 
     # Instantiates a controller object with the specified parameters
-    c = Controller(data=data, verbose=verbose)
-    c.memcache_client.flush_all()
+    metrics = Metrics('controller')
+    wakeup = createWakeUp(args, 'controller', args.robotid)
+    c = Controller(data=data, verbose=verbose, transport=createTransport(args), robot_id=args.robotid,
+                   chunk_rows=args.chunksize, window=args.window, metrics=metrics,
+                   max_correction=args.maxcorrection, wakeup=wakeup)
+    if not args.noflush:
+        c.transport.flush()
     c.readData()
+    if args.resume:
+        c.resume()
 
-    # Main loop that is run by tkinter
-    def run():
-        if loop.get() and c.areCommandsAvailable():
-            c.correctPath()
-            c.sendDataToRobot()
-        controller_gui.after(1000, run)
+    # Cleared by the GUI to disable the controller.
+    enabled = threading.Event()
+    enabled.set()
 
-    # Tkinter gui
-    controller_gui = tk.Tk()
-    controller_gui.title('Robot Controller')
-    controller_gui.geometry('200x200')
-    loop = tk.BooleanVar(controller_gui)
-    loop.set(True)
-    radiobutton_widget1 = tk.Radiobutton(controller_gui, text="Enable Controller", variable=loop, value=True,
-                                         indicatoron=False, command=run)
-    radiobutton_widget2 = tk.Radiobutton(controller_gui, text="Disable Controller", variable=loop, value=False,
-                                         indicatoron=False, command=run)
-    exit_button = tk.Button(controller_gui, text="Exit", command=controller_gui.destroy)
-
-    radiobutton_widget1.pack()
-    radiobutton_widget2.pack()
-    exit_button.pack()
+    # Main loop that is run by the scheduler. Idle while the window is full and nothing arrives.
+    def run():
+        busy = False
+        if enabled.is_set() and c.areCommandsAvailable():
+            busy = c.receiveMessages()
+            busy = c.sendDataToRobot() > 0 or busy
+        c.transport.endTick()
+        return busy
 
-    controller_gui.after(1000, run)
-    controller_gui.mainloop()
+    reporter = startMetrics(args, metrics)
+    scheduler = AdaptiveScheduler(min(args.minrate, args.rate), args.rate, run, wakeup=wakeup, metrics=metrics)
+    notifyReady()
+    if args.headless:
+        scheduler.runForever()
+    else:
+        runGui(scheduler, enabled)
+    reporter.stop()
 
 
-main()
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,3 @@
-from influxdb import InfluxDBClient
 import logging
 import sys
 import argparse
@@ -7,6 +6,53 @@ import argparse
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Measurement the sensor writes its errors to, with one field per axis.
+MEASUREMENT = 'robot_sensor'
+AXES = ('x', 'y', 'z')
+
+# Rollup tiers as (interval, retention policy, default duration, how far back each run recomputes).
+# Each tier is computed from the raw points, which arrive up to the sensor's flush interval late.
+ROLLUPS = [
+    ('1s', 'rollup_1s', '7d', '10s'),
+    ('1m', 'rollup_1m', '90d', '2m'),
+    ('1h', 'rollup_1h', 'INF', '2h'),
+]
+
+
+# Returns the select statement of the continuous query that rolls raw errors up into one tier.
+# Each axis's error is rolled up into its own fields by the same query: the mean of the signed error, which shows
+# any bias, e.g. "mean_error_y", and the max and 95th percentile of its magnitude, e.g. "max_abs_error_y".
+# Points are grouped by every tag, so each robot and sensor gets its own series.
+def rollupQuery(db_name, raw_policy, interval, policy):
+    fields = ', '.join('mean("error_{0}") AS "mean_error_{0}", max("abs_error_{0}") AS "max_abs_error_{0}", '
+                       'percentile("abs_error_{0}", 95) AS "p95_abs_error_{0}"'.format(axis) for axis in AXES)
+    return ('SELECT %s INTO "%s"."%s"."%s" FROM "%s"."%s"."%s" GROUP BY time(%s), *'
+            % (fields, db_name, policy, MEASUREMENT, db_name, raw_policy, MEASUREMENT, interval))
+
+
+# Creates or updates a retention policy.
+def setRetentionPolicy(client, db_name, name, duration, default=False):
+    if any(policy['name'] == name for policy in client.get_list_retention_policies(db_name)):
+        client.alter_retention_policy(name, database=db_name, duration=duration, replication='1', default=default)
+    else:
+        client.create_retention_policy(name, duration, database=db_name, replication='1', default=default)
+
+
+# Creates the rollup retention policies and the continuous queries that fill them, replacing any existing ones.
+def createRollups(client, db_name, raw_policy, durations):
+    existing = set()
+    for database in client.get_list_continuous_queries():
+        for query in database.get(db_name, []):
+            existing.add(query['name'])
+    for (interval, policy, _, resample_for), duration in zip(ROLLUPS, durations):
+        setRetentionPolicy(client, db_name, policy, duration)
+        cq_name = 'cq_%s_%s' % (MEASUREMENT, interval)
+        if cq_name in existing:
+            client.drop_continuous_query(cq_name, database=db_name)
+        client.create_continuous_query(cq_name, rollupQuery(db_name, raw_policy, interval, policy), database=db_name,
+                                       resample_opts='EVERY %s FOR %s' % (interval, resample_for))
+        logger.info("Rolling %s up every %s into %s, kept for %s", MEASUREMENT, interval, policy, duration)
+
 
 def main():
     parser = argparse.ArgumentParser(description='DB setup')
@@ -16,6 +62,10 @@ def main():
     parser.add_argument('--dbname', help='Database to insert data to')
     parser.add_argument('--port', type=int, help='Port for connecting to DB')
     parser.add_argument('--policyname', help='Policy for DB')
+    parser.add_argument('--rawduration', default='1d', help='How long raw points are kept')
+    for interval, _, duration, _ in ROLLUPS:
+        parser.add_argument('--duration%s' % interval, default=duration,
+                            help='How long the %s rollups are kept' % interval)
     args = parser.parse_args()
 
     user = args.user
@@ -25,11 +75,17 @@ def main():
     db_name = args.dbname
     policy_name = args.policyname
 
+    from influxdb import InfluxDBClient
+
     client = InfluxDBClient(host=host, username=user, password=password, port=port)
 
     try:
         client.create_database(db_name)
-        client.create_retention_policy(policy_name, '1d', database=db_name, replication='1', default=False)
+
+        # Raw points go to the default policy, so they expire once they are rolled up.
+        setRetentionPolicy(client, db_name, policy_name, args.rawduration, default=True)
+        createRollups(client, db_name, policy_name,
+                      [getattr(args, 'duration%s' % interval) for interval, _, _, _ in ROLLUPS])
     except Exception as exception:
         logger.error(exception)
         sys.exit(1)
@@ -37,4 +93,5 @@ def main():
     logger.info(client.get_list_database())
 
 
-main()
+if __name__ == '__main__':
+    main()
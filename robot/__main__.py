@@ -0,0 +1,5 @@
+from robot.robot import main
+
+# Runs the robot with "python3 -m robot".
+if __name__ == '__main__':
+    main()
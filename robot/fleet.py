@@ -0,0 +1,185 @@
+import numpy as np
+import time
+import argparse
+import logging
+from common import wire
+from common.metrics import Metrics, addMetricsArguments, startMetrics
+from common.ready import notifyReady
+from common.scheduler import AdaptiveScheduler, addSchedulerArguments
+from common.transport import DEFAULT_WINDOW, MemcachedTransport, robotChannel, addTransportArguments, createTransport
+
+# channels for the transport. Each robot's channels are suffixed with its ID.
+keyControllerToRobot = 'Controller.Robot'
+keyRobotToController = 'Robot.Controller'
+keyRobotToSensor = 'Sensor.Robot'
+
+# logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+# Simulates many robots in one process. Robot i behaves like a Robot with robot_id=i, but the locations of all
+# robots are held in one (N, 3) array and every robot is moved in one vectorized step per tick.
+class RobotFleet:
+    def __init__(self, count, vector=np.array([0.0, 0.0, 0.0]), random_error=1.0, verbose=True, transport=None,
+                 sensor_noise=0.0, seed=None, window=DEFAULT_WINDOW, metrics=None):
+        # The current location of each robot. Every robot starts at vector.
+        self.locations = np.tile(np.asarray(vector, dtype=np.float64), (count, 1))
+
+        # Moves received from the controllers and not yet made, and which robots have one.
+        self.commands = np.zeros((count, 3))
+        self.has_command = np.zeros(count, dtype=bool)
+
+        # Sequence number of the command each robot expects next, and of the last command each robot applied.
+        self.next_seq = np.ones(count, dtype=np.int64)
+        self.applied_seq = np.zeros(count, dtype=np.int64)
+        self.command_seq = np.zeros(count, dtype=np.int64)
+
+        # Number of commands the controllers may have in flight. Must match the controllers.
+        self.window = window
+
+        # Transport for communicating with the controllers and sensors. Defaults to memcached.
+        self.transport = transport if transport is not None else MemcachedTransport()
+
+        # Latency histograms. The transport records its own latencies here too unless it already has metrics.
+        self.metrics = metrics if metrics is not None else Metrics('fleet')
+        if self.transport.metrics is None:
+            self.transport.metrics = self.metrics
+
+        # Channel names for each robot, in robot order.
+        self.command_channels = [robotChannel(keyControllerToRobot, i) for i in range(count)]
+        self.ack_channels = [robotChannel(keyRobotToController, i) for i in range(count)]
+        self.position_channels = [robotChannel(keyRobotToSensor, i) for i in range(count)]
+
+        # Largest random error each robot makes per move on each axis. A scalar applies to every axis; 0 never errs.
+        self.random_error = wire.axisVector(random_error)
+        self.has_random_error = bool(self.random_error.any())
+
+        # Standard deviation of the Gaussian noise added to each axis of the positions reported to the sensors.
+        self.sensor_noise = sensor_noise
+
+        # Random number generator for move errors and sensor noise.
+        self.random = np.random.default_rng(seed)
+
+        # Buffers for each tick's move errors, and for the positions and acknowledgements sent.
+        self.errors = np.empty((count, 3))
+        self.records = wire.makeRecords(2 * count)
+
+        # Verbose logging
+        self.verbose = verbose
+
+    # Number of robots in the fleet.
+    def __len__(self):
+        return len(self.locations)
+
+    # Accessor function to return every robot's current location
+    def getPositions(self):
+        return self.locations
+
+    # Moves every robot that has a command, in place. Robots without one have a zero command.
+    # On each axis with a random_error, each moving robot errs half of the time by between 0 and random_error:
+    # an error drawn uniformly from [-1, 1) and clipped at 0 has that distribution.
+    def processMoves(self):
+        moving = self.has_command
+        self.locations += self.commands
+        if self.has_random_error:
+            errors = self.errors
+            self.random.random(out=errors)
+            errors *= 2.0
+            errors -= 1.0
+            np.maximum(errors, 0.0, out=errors)
+            errors *= self.random_error
+            errors *= moving[:, np.newaxis]
+            self.locations += errors
+        np.copyto(self.applied_seq, self.command_seq, where=moving)
+        self.commands.fill(0.0)
+        self.has_command.fill(False)
+
+    # Receives the next command for every robot in one bulk read of each robot's next window slot.
+    # Corrections are already added to the commands by the controllers.
+    def receiveDataFromControllers(self):
+        slots = {self.transport.windowSlot(channel, int(seq), self.window): i
+                 for i, (channel, seq) in enumerate(zip(self.command_channels, self.next_seq))}
+        for slot, record in self.transport.takeMany(slots).items():
+            i = slots[slot]
+            self.metrics.observeHop('controller_to_robot', record)
+            seq = int(record['seq'])
+            if seq < self.next_seq[i]:
+                # A command left over from an earlier run of the controller.
+                continue
+            if seq > self.next_seq[i]:
+                logger.warning("Robot %d - Lost commands %d to %d", i, self.next_seq[i], seq - 1)
+            self.commands[i] = record['xyz']
+            self.command_seq[i] = seq
+            self.next_seq[i] = seq + 1
+            self.has_command[i] = True
+
+    # Sends every robot's position to its sensor and acknowledges the last command each robot applied to its
+    # controller, in one bulk write. Both are stamped with the sequence number of the last command applied.
+    # Acknowledgements are sent every tick, like a single robot's.
+    def sendPositionsAndAcks(self):
+        count = len(self)
+        records = self.records
+        records['seq'][:count] = records['seq'][count:] = self.applied_seq
+        records['ts'] = time.monotonic_ns()
+        records['xyz'][:count] = records['xyz'][count:] = self.locations
+        if self.sensor_noise > 0:
+            records['xyz'][:count] += self.random.normal(0.0, self.sensor_noise, size=(count, 3))
+        batches = {channel: records[i:i + 1] for i, channel in enumerate(self.position_channels)}
+        batches.update((channel, records[count + i:count + i + 1]) for i, channel in enumerate(self.ack_channels))
+        self.transport.putMany(batches, ttl=2)
+
+    # Function to return status of the robots' commands.
+    def areCommandsAvailable(self):
+        return bool(self.has_command.any())
+
+    # Function to output info logging
+    def doILog(self):
+        return self.verbose
+
+
+def main():
+    # Code for parsing command line arguments
+    parser = argparse.ArgumentParser(description='Robot fleet setup')
+    parser.add_argument('--count', type=int, default=100, help='Number of robots to simulate')
+    parser.add_argument('--randomerror', type=wire.parseAxes, nargs='?', const=1.0, default=0.0,
+                        help='Makes the robots randomly err by up to this much per move, on every axis or on each axis '
+                             'given as x,y,z. Defaults to 1.0 when given without a value')
+    parser.add_argument('--verbose', action='store_true', help='If true, provide verbose output')
+    parser.add_argument('--rate', type=float, default=1.0, help='Number of moves per second while busy')
+    parser.add_argument('--sensornoise', type=float, default=0.0,
+                        help='Standard deviation of the noise added to the positions reported to the sensors')
+    parser.add_argument('--seed', type=int, help='Seed for the random move errors and sensor noise')
+    addTransportArguments(parser)
+    addMetricsArguments(parser)
+    addSchedulerArguments(parser, wakeup=False)
+    args = parser.parse_args()
+
+    metrics = Metrics('fleet')
+    fleet = RobotFleet(args.count, random_error=args.randomerror, verbose=args.verbose,
+                       transport=createTransport(args), sensor_noise=args.sensornoise, seed=args.seed,
+                       window=args.window, metrics=metrics)
+
+    # Main loop that is run by the scheduler. Idle while no robot has a command to apply.
+    # The fleet does not listen for wake-ups, since a busy fleet of any size almost always has work.
+    def run():
+        fleet.receiveDataFromControllers()
+        moved = fleet.areCommandsAvailable()
+        if moved:
+            if fleet.doILog():
+                logger.info("Robot fleet: %d robots moving, mean location %s", fleet.has_command.sum(),
+                            fleet.getPositions().mean(axis=0))
+            fleet.processMoves()
+        fleet.sendPositionsAndAcks()
+        fleet.transport.endTick()
+        return moved
+
+    reporter = startMetrics(args, metrics)
+    scheduler = AdaptiveScheduler(min(args.minrate, args.rate), args.rate, run, metrics=metrics)
+    notifyReady()
+    scheduler.runForever()
+    reporter.stop()
+
+
+if __name__ == '__main__':
+    main()
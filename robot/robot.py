@@ -1,14 +1,18 @@
 import numpy as np
-import time
-import pylibmc
 import argparse
 import logging
-import tkinter as tk
+import time
 from collections import deque
-
-# keys for memcached
+from common import wire
+from common.metrics import Metrics, addMetricsArguments, startMetrics
+from common.ready import notifyReady
+from common.scheduler import AdaptiveScheduler, addSchedulerArguments
+from common.transport import DEFAULT_WINDOW, MemcachedTransport, robotChannel, addTransportArguments, createTransport
+from common.wakeup import createWakeUp, wakeupName
+
+# channels for the transport
 keyControllerToRobot = 'Controller.Robot'
-keyControllerToRobotCorrect = 'Controller.Correct'
+keyRobotToController = 'Robot.Controller'
 keyRobotToSensor = 'Sensor.Robot'
 
 # logging
@@ -17,66 +21,141 @@ logger = logging.getLogger(__name__)
 
 
 class Robot:
-    def __init__(self, vector=np.array([0.0, 0.0, 0.0]), random_error_y=True, verbose=True):
+    # Number of move errors drawn from the random number generator at a time.
+    ERROR_BLOCK_SIZE = 4096
+
+    def __init__(self, vector=np.array([0.0, 0.0, 0.0]), random_error=1.0, verbose=True, transport=None,
+                 sensor_noise=0.0, robot_id=None, window=DEFAULT_WINDOW,
+                 metrics=None, seed=None, wakeup=None):
         # The current location of the robot. Defaults to [0.0, 0.0, 0.0]
-        self.location = vector
+        # A copy, since it is updated in place.
+        self.location = np.array(vector, dtype=np.float64)
+
+        # Transport for communicating with the controller and sensor. Defaults to memcached.
+        self.transport = transport if transport is not None else MemcachedTransport()
 
-        # client for connecting to memcached.
-        self.memcache_client = pylibmc.Client(['localhost'], binary=True, behaviors={"tcp_nodelay": True, "ketama": True})
+        # ID the robot is addressed by in channel names. None uses the channels shared by every robot.
+        self.robot_id = robot_id
+        self.channels = {key: robotChannel(key, robot_id)
+                         for key in (keyControllerToRobot, keyRobotToController, keyRobotToSensor)}
 
         # Structure for queueing commands that are sent from the controller.
-        # Commands are a 3-dimension numpy array
+        # Commands are (sequence number, 3-dimension numpy array) tuples.
         self.commands = deque()
 
-        # Boolean parameter that causes the robot to randomly error on the y-axis if set to True.
-        self.random_error_y = random_error_y
+        # Number of commands the controller may have in flight. Must match the controller.
+        self.window = window
+
+        # Sequence number of the next command expected from the controller.
+        self.next_seq = 1
+
+        # Sequence number of the last command the robot moved by. Reported to the sensor with each position.
+        self.applied_seq = 0
+
+        # Latency histograms. The transport records its own latencies here too unless it already has metrics.
+        self.metrics = metrics if metrics is not None else Metrics('robot')
+        if self.transport.metrics is None:
+            self.transport.metrics = self.metrics
+
+        # Largest random error the robot makes per move on each axis. A scalar applies to every axis; 0 never errs.
+        self.random_error = wire.axisVector(random_error)
+        self.has_random_error = bool(self.random_error.any())
+
+        # Standard deviation of the Gaussian noise added to each axis of the position reported to the sensor.
+        # Simulates an imperfect sensor; the robot's actual location is unaffected.
+        self.sensor_noise = sensor_noise
+
+        # Random number generator for move errors and sensor noise.
+        self.random = np.random.default_rng(seed)
+
+        # Move errors drawn ahead of time, and the index of the next one to use.
+        self.errors = np.empty((self.ERROR_BLOCK_SIZE, 3))
+        self.next_error = self.ERROR_BLOCK_SIZE
+
+        # Buffer the position and acknowledgement are sent from.
+        self.records = wire.makeRecords(2)
 
         # Verbose logging
         self.verbose = verbose
 
+        # common.wakeup.WakeUp the controller and sensor are woken with once a new command is applied, if set.
+        self.wakeup = wakeup
+        self.wakeup_names = (wakeupName('controller', robot_id), wakeupName('sensor', robot_id))
+
+        # Sequence number of the last command applied when the controller and sensor were last woken.
+        self.woken_seq = 0
+
     # Accessor functino to return robot's current location
     def getPosition(self):
         return self.location
 
     # Moves the robot
     # @param vector The value to move the robot by.
-    # An error component is randomly chosen if random_error_y is True.
+    # A random error is added on each axis that has a random_error.
     def processMove(self, vector):
-        self.location += vector
-        if self.random_error_y:
-            # choose between 0 and 1.
-            chance = np.random.randint(2)
-
-            # choose a floating point number between 0 and 1.
-            # value is added to robot's location if chance > 0.
-            error = chance * np.random.uniform(0, 1, size=1)[0]
-            self.location += [0.0, error, 0.0]
+        np.add(self.location, vector, out=self.location)
+        if self.has_random_error:
+            self.location += self.nextError()
+
+    # Returns the next move error. On each axis it is half of the time 0, otherwise between 0 and random_error.
+    # Errors are drawn a block at a time, uniformly from [-1, 1) and clipped at 0, which has that distribution.
+    def nextError(self):
+        if self.next_error == len(self.errors):
+            self.random.random(out=self.errors)
+            self.errors *= 2.0
+            self.errors -= 1.0
+            np.maximum(self.errors, 0.0, out=self.errors)
+            self.errors *= self.random_error
+            self.next_error = 0
+        error = self.errors[self.next_error]
+        self.next_error += 1
+        return error
 
     # Function to pop the latest command from the controller. Calls processMove to move the robot.
     def fetchAndMove(self):
-        vector = self.commands.popleft()
-        if type(vector).__module__ == np.__name__:
-            self.processMove(vector)
+        seq, vector = self.commands.popleft()
+        self.processMove(vector)
+        self.applied_seq = seq
         return vector
 
-    # Receives data from the controller using data from the keyControllerToRobot and keyControllerToRobotCorrect keys
-    # Only applies correctional movement if data from keyControllerToRobotCorrect is found.
+    # Receives commands from the controller in sequence order from the keyControllerToRobot window slots.
+    # Every slot is read in one takeBatches, since the controller never has more than a window of commands in flight.
+    # Corrections are already added to the commands by the controller.
     def receiveDataFromController(self):
-        vector = self.memcache_client.get(keyControllerToRobot)
-        correction = self.memcache_client.get(keyControllerToRobotCorrect)
-        if type(vector).__module__ == np.__name__:
-            if correction is not None:
-                vector[1] += correction[1]
-                self.memcache_client.delete(keyControllerToRobotCorrect)
-            self.commands.append(vector)
-            self.memcache_client.delete(keyControllerToRobot)
-
-    # Function to communicate robot's position to the sensor. Sends data to the keyRobotToSensor key.
-    def sendPositionToSensor(self):
-        position = self.getPosition()
-        if self.memcache_client.get(keyRobotToSensor) is not None:
-            self.memcache_client.delete(keyRobotToSensor)
-        self.memcache_client.set(keyRobotToSensor, position, time=2)
+        slots = [self.transport.windowSlot(self.channels[keyControllerToRobot], seq, self.window)
+                 for seq in range(self.next_seq, self.next_seq + self.window)]
+        batches = list(self.transport.takeBatches(slots).values())
+        if not batches:
+            return
+        records = np.concatenate(batches)
+        for record in records[np.argsort(records['seq'], kind='stable')]:
+            self.metrics.observeHop('controller_to_robot', record)
+            seq = int(record['seq'])
+            if seq < self.next_seq:
+                # A command left over from an earlier run of the controller.
+                continue
+            if seq > self.next_seq:
+                logger.warning("Robot - Lost commands %d to %d", self.next_seq, seq - 1)
+            self.commands.append((seq, record['xyz']))
+            self.next_seq = seq + 1
+
+    # Sends the robot's position to the sensor on the keyRobotToSensor channel and acknowledges the last command
+    # applied on the keyRobotToController channel, in one putMany.
+    # Both are stamped with the sequence number of the last command applied. The acknowledgement lets the
+    # controller send more and reuse its window slots. It is sent every tick, so an expired one is soon replaced.
+    # The position sent to the sensor includes simulated sensor noise if sensor_noise is set.
+    def sendPositionAndAck(self):
+        records = self.records
+        records['seq'] = self.applied_seq
+        records['ts'] = time.monotonic_ns()
+        records['xyz'] = self.getPosition()
+        if self.sensor_noise > 0:
+            records['xyz'][0] += self.random.normal(0.0, self.sensor_noise, size=3)
+        self.transport.putMany({self.channels[keyRobotToSensor]: records[:1],
+                                self.channels[keyRobotToController]: records[1:]}, ttl=2)
+        if self.wakeup is not None and self.woken_seq != self.applied_seq:
+            self.wakeup.notify(*self.wakeup_names)
+            self.woken_seq = self.applied_seq
 
     # Function to return status of queue.
     def areCommandsAvailable(self):
@@ -89,11 +168,38 @@ class Robot:
         return self.verbose
 
 
+# Tkinter gui. An optional front-end over the scheduler, which runs on a background thread.
+def runGui(scheduler):
+    import tkinter as tk
+
+    robot_gui = tk.Tk()
+    robot_gui.title('Robot Process')
+    robot_gui.geometry('200x200')
+
+    exit_button = tk.Button(robot_gui, text="Exit", command=robot_gui.destroy)
+    exit_button.pack()
+
+    scheduler.start()
+    robot_gui.mainloop()
+    scheduler.stop()
+
+
 def main():
     # Code for parsing command line arguments
     parser = argparse.ArgumentParser(description='Robot setup')
-    parser.add_argument('--randomerror', action='store_true', help='If true, robot will randomly error on the y-axis')
+    parser.add_argument('--randomerror', type=wire.parseAxes, nargs='?', const=1.0, default=0.0,
+                        help='Makes the robot randomly err by up to this much per move, on every axis or on each axis '
+                             'given as x,y,z. Defaults to 1.0 when given without a value')
     parser.add_argument('--verbose', action='store_true', help='If true, provide verbose output')
+    parser.add_argument('--headless', action='store_true', help='If true, run without the tkinter window')
+    parser.add_argument('--rate', type=float, default=1.0, help='Number of moves per second while busy')
+    parser.add_argument('--sensornoise', type=float, default=0.0,
+                        help='Standard deviation of the noise added to the position reported to the sensor')
+    parser.add_argument('--seed', type=int, help='Seed for the random move errors and sensor noise')
+    addTransportArguments(parser)
+    addMetricsArguments(parser)
+    addSchedulerArguments(parser)
+    parser.add_argument('--robotid', help='ID the robot is addressed by in channel names')
     args = parser.parse_args()
     random_error = args.randomerror
     verbose = args.verbose
@@ -102,29 +208,34 @@ def main():
     start_pos = np.array([0.0, 0.0, 0.0])
 
     # Instantiates a robot object with the specified parameters
-    robot = Robot(start_pos, random_error_y=random_error, verbose=verbose)
-
-    # Main loop that is run by tkinter
+    metrics = Metrics('robot')
+    wakeup = createWakeUp(args, 'robot', args.robotid)
+    robot = Robot(start_pos, random_error=random_error, verbose=verbose, transport=createTransport(args),
+                  sensor_noise=args.sensornoise, robot_id=args.robotid, window=args.window, metrics=metrics,
+                  seed=args.seed, wakeup=wakeup)
+
+    # Main loop that is run by the scheduler. Idle while there are no commands to apply, when the position and
+    # acknowledgement are still sent, but less often.
     def run():
         robot.receiveDataFromController()
-        robot.sendPositionToSensor()
-        if robot.areCommandsAvailable():
+        moved = robot.areCommandsAvailable()
+        if moved:
             if robot.doILog():
-                logstr = "Robot: " + np.array2string(robot.getPosition())
-                logger.info('%s', logstr)
+                logger.info("Robot: %s", robot.getPosition())
             robot.fetchAndMove()
-        robot_gui.after(1000, run)
-
-    # Tkinter gui
-    robot_gui = tk.Tk()
-    robot_gui.title('Robot Process')
-    robot_gui.geometry('200x200')
-
-    exit_button = tk.Button(robot_gui, text="Exit", command=robot_gui.destroy)
-    exit_button.pack()
-
-    robot_gui.after(1000, run)
-    robot_gui.mainloop()
-
-
-main()
+        robot.sendPositionAndAck()
+        robot.transport.endTick()
+        return moved
+
+    reporter = startMetrics(args, metrics)
+    scheduler = AdaptiveScheduler(min(args.minrate, args.rate), args.rate, run, wakeup=wakeup, metrics=metrics)
+    notifyReady()
+    if args.headless:
+        scheduler.runForever()
+    else:
+        runGui(scheduler)
+    reporter.stop()
+
+
+if __name__ == '__main__':
+    main()
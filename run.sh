@@ -1,7 +1,7 @@
 #!/usr/bin/env bash
 
-python3 controller/controller.py --data "./data/simple.csv" --verbose &
-sleep 1
-python3 sensor/sensor1.py --host 'localhost' --user 'root' --password 'root' --dbname 'sensor' --port 8086 --verbose &
-sleep 1
-python3 robot/robot.py --randomerror --verbose &
+cd "$(dirname "$0")"
+
+# Starts the controller, sensor and robot, each once the one before it is ready, and restarts any that fail.
+exec python3 -m supervisor.supervisor --data "./data/simple.csv" --randomerror --verbose \
+    --host 'localhost' --user 'root' --password 'root' --dbname 'sensor' --port 8086 "$@"
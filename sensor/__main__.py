@@ -0,0 +1,5 @@
+from sensor.sensor1 import main
+
+# Runs the sensor with "python3 -m sensor".
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import logging
+import queue
+import threading
+import time
+
+# logging
+logger = logging.getLogger(__name__)
+
+
+# Raised when the robot has not reported its location within the sensor's timeout.
+class SensorTimeoutError(Exception):
+    pass
+
+
+class SensorEngine:
+    def __init__(self, sensor, on_timeout='exit', queue_size=100):
+        # Sensor whose transport I/O and estimation run on the engine thread.
+        self.sensor = sensor
+
+        # What to do when the robot stops reporting:
+        # 'exit' stops the engine, 'retry' keeps waiting and 'reset' clears the sensor state before waiting again.
+        if on_timeout not in ('exit', 'retry', 'reset'):
+            raise ValueError("on_timeout must be 'exit', 'retry' or 'reset', not %r" % on_timeout)
+        self.on_timeout = on_timeout
+
+        # Updates handed to the GUI. Each update is a (robot location, expected location) tuple.
+        self.updates = queue.Queue(maxsize=queue_size)
+
+        # Corrections are only sent to the controller while this is set.
+        self.enabled = threading.Event()
+        self.enabled.set()
+
+        # Non-zero if the engine stopped because of an error.
+        self.exit_code = 0
+
+        self._thread = None
+
+    # Starts the engine thread.
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='sensor-engine', daemon=True)
+        self._thread.start()
+
+    # Stops the engine thread, interrupting any wait for the robot.
+    def stop(self, timeout=5.0):
+        self.sensor.stop_event.set()
+        if self.sensor.wakeup is not None:
+            self.sensor.wakeup.wake()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    # Function to return status of the engine thread.
+    def isRunning(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    # Enables or disables sending corrections to the controller.
+    def setEnabled(self, enabled):
+        if enabled:
+            self.enabled.set()
+        else:
+            self.enabled.clear()
+
+    # Runs sensor steps until stopped.
+    def run(self):
+        while not self.sensor.stop_event.is_set():
+            try:
+                self.step()
+            except SensorTimeoutError:
+                logger.error("Sensor - Sensor waiting for robot time out")
+                if self.on_timeout == 'exit':
+                    self.exit_code = 1
+                    self.sensor.stop_event.set()
+                elif self.on_timeout == 'reset':
+                    self.sensor.clearSensorRobotLocation()
+            except Exception:
+                # Anything else would end the thread silently, leaving the GUI up and the process exiting cleanly.
+                logger.exception("Sensor - Sensor engine failed")
+                self.exit_code = 1
+                self.sensor.stop_event.set()
+
+    # Waits for the next robot location, updates the estimate and sends any correction to the controller.
+    # The time spent waiting for the robot is recorded as 'wait' and the rest of the step as 'loop'.
+    def step(self):
+        metrics = self.sensor.metrics
+        start = time.perf_counter()
+        self.sensor.getControllerData()
+        waited = time.perf_counter()
+        location = self.sensor.fetchSensorRobotLocation()
+        fetched = time.perf_counter()
+        if location is not None and self.sensor.updateEstimate():
+            self.sensor.sendCorrectionData(self.enabled.is_set())
+        self.sensor.transport.endTick()
+        metrics.observe('wait', fetched - waited)
+        metrics.observe('loop', time.perf_counter() - fetched + waited - start)
+        if location is not None:
+            self.publish(location, self.sensor.getSensorExpectedLocation())
+
+    # Hands an update to the GUI, discarding the oldest one if the GUI has fallen behind.
+    def publish(self, location, expected):
+        update = (location.copy(), None if expected is None else expected.copy())
+        while True:
+            try:
+                self.updates.put_nowait(update)
+                return
+            except queue.Full:
+                try:
+                    self.updates.get_nowait()
+                except queue.Empty:
+                    pass
+
+    # Returns every update published since the last call without blocking.
+    def drain(self):
+        updates = []
+        while True:
+            try:
+                updates.append(self.updates.get_nowait())
+            except queue.Empty:
+                return updates
@@ -0,0 +1,59 @@
+import numpy as np
+
+
+# Estimates the robot's position as its latest reported position. This is the sensor's original behavior.
+class RawEstimator:
+    # Returns the measurement unchanged.
+    # @param u The commanded move since the last step.
+    # @param z The reported position.
+    def step(self, u, z):
+        return np.array(z, dtype=np.float64)
+
+    # Forgets all state.
+    def reset(self):
+        pass
+
+
+# Kalman filter for robot positions reported with noise. Each axis is filtered independently with the model
+#   x[k] = x[k-1] + u[k] + w,  w ~ N(0, process_noise)
+#   z[k] = x[k] + v,           v ~ N(0, measurement_noise)
+# where u is the commanded move. Process noise covers the robot's own movement error and corrections the sensor
+# does not know about. Any number of robots can be filtered at once by passing (N, 3) arrays.
+class KalmanEstimator:
+    def __init__(self, process_noise=0.25, measurement_noise=0.01):
+        # Variances. Scalars, or per-axis vectors that broadcast against the state.
+        self.process_noise = np.asarray(process_noise, dtype=np.float64)
+        self.measurement_noise = np.asarray(measurement_noise, dtype=np.float64)
+
+        # Estimated position and its variance. None until the first measurement.
+        self.x = None
+        self.p = None
+
+    # Predicts each position forward by the commanded move, corrects it with the reported position and
+    # returns the new estimate. The first call initializes the filter from the measurement.
+    def step(self, u, z):
+        z = np.asarray(z, dtype=np.float64)
+        if self.x is None:
+            self.x = z.copy()
+            self.p = np.broadcast_to(self.measurement_noise, z.shape).copy()
+            return self.x.copy()
+        self.x += u
+        self.p += self.process_noise
+        gain = self.p / (self.p + self.measurement_noise)
+        self.x += gain * (z - self.x)
+        self.p *= 1.0 - gain
+        return self.x.copy()
+
+    # Forgets all state.
+    def reset(self):
+        self.x = None
+        self.p = None
+
+
+# Creates the estimator chosen on the command line.
+def createEstimator(name, process_noise=0.25, measurement_noise=0.01):
+    if name == 'kalman':
+        return KalmanEstimator(process_noise=process_noise, measurement_noise=measurement_noise)
+    if name == 'raw':
+        return RawEstimator()
+    raise ValueError("unknown estimator %r" % name)
@@ -0,0 +1,204 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import sys
+from common.metrics import Metrics, startMetrics
+from common.ready import notifyReady
+from common.scheduler import AdaptiveScheduler, addSchedulerArguments
+from common.shard import HashRing, Membership, hashKey
+from common.transport import createTransport
+from sensor.estimator import createEstimator
+from sensor.sensor1 import Sensor, addSensorArguments, createWriterFromArgs, keyRobotToSensor
+
+# logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+# Monitors a set of robots from one process, with one Sensor per robot sharing a transport and writer.
+# Each step reads every robot's commands and location with one readBatches and sends every correction with one
+# putMany, so the round trips per step do not grow with the number of robots.
+class SensorWorker:
+    def __init__(self, make_sensor, transport):
+        # Creates the Sensor for a robot ID.
+        self.make_sensor = make_sensor
+
+        # Transport shared by the sensors.
+        self.transport = transport
+
+        # Sensor of each robot monitored, by robot ID.
+        self.sensors = {}
+
+        # Corrections are only sent to the controllers while this is True.
+        self.enabled = True
+
+    # Monitors exactly the given robots. A robot that is added starts from its next reported location.
+    def assign(self, robot_ids):
+        robot_ids = set(robot_ids)
+        for robot_id in [robot_id for robot_id in self.sensors if robot_id not in robot_ids]:
+            del self.sensors[robot_id]
+        for robot_id in robot_ids:
+            if robot_id not in self.sensors:
+                self.sensors[robot_id] = self.make_sensor(robot_id)
+
+    # Takes every robot's new commands and reads its latest location, updates the estimates and sends the
+    # corrections. A location may be read again until the robot reports the next one, so one with the timestamp of
+    # the last one received is skipped.
+    # Returns True if there were any new commands or locations.
+    def step(self):
+        slots = {}
+        positions = {}
+        for sensor in self.sensors.values():
+            for slot in sensor.controllerSlots():
+                slots[slot] = sensor
+            positions[sensor.channels[keyRobotToSensor]] = sensor
+        if not positions:
+            return False
+        batches = self.transport.readBatches(take=list(slots), latest=list(positions))
+
+        commands = {}
+        for channel, records in batches.items():
+            if channel in slots:
+                commands.setdefault(slots[channel], {})[channel] = records
+
+        corrections = {}
+        busy = bool(commands)
+        for channel, sensor in positions.items():
+            if sensor in commands:
+                sensor.getControllerData(commands[sensor])
+            records = batches.get(channel)
+            if records is None or records[-1]['ts'] == sensor.robot_ts:
+                continue
+            busy = True
+            sensor.receiveRobotLocation(records[-1])
+            if sensor.updateEstimate():
+                sensor.sendCorrectionData(self.enabled, batches=corrections)
+        if corrections:
+            self.transport.putMany(corrections)
+        return busy
+
+
+# Runs a SensorWorker in a worker process until stop is set. The robots to monitor arrive on assignments
+# as lists of robot IDs; each replaces the previous one.
+def runWorker(index, args, sensor_id, assignments, stop):
+    # Ctrl-C is handled by the pool, which stops the workers through stop.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    metrics = Metrics('sensor.w%d' % index)
+    transport = createTransport(args)
+    transport.metrics = metrics
+    writer = createWriterFromArgs(args, '%s.w%d' % (sensor_id, index))
+    writer.start()
+    if args.metricsport is not None:
+        args.metricsport += index
+    reporter = startMetrics(args, metrics, writer=writer)
+
+    def makeSensor(robot_id):
+        estimator = createEstimator(args.estimator, process_noise=args.processnoise,
+                                    measurement_noise=args.measurementnoise)
+        return Sensor(None, None, None, None, None, tolerance=args.tolerance, verbose=args.verbose, timeout=0,
+                      transport=transport, estimator=estimator, robot_id=robot_id, window=args.window,
+                      metrics=metrics, writer=writer, sensor_id=sensor_id)
+
+    worker = SensorWorker(makeSensor, transport)
+
+    # Main loop that is run by the scheduler. Idle while none of the robots report.
+    def run():
+        robot_ids = None
+        while True:
+            try:
+                robot_ids = assignments.get_nowait()
+            except queue.Empty:
+                break
+        if robot_ids is not None:
+            worker.assign(robot_ids)
+            logger.info("Sensor worker %d - Monitoring %d robots", index, len(robot_ids))
+        busy = worker.step()
+        transport.endTick()
+        if stop.is_set():
+            scheduler.stop()
+        return busy
+
+    scheduler = AdaptiveScheduler(min(args.minrate, args.pollingrate), args.pollingrate, run, metrics=metrics)
+    try:
+        scheduler.run()
+    finally:
+        reporter.stop()
+
+        # Flush any points still waiting to be written.
+        writer.close()
+        transport.close()
+
+
+def main():
+    # Code for parsing command line arguments
+    parser = argparse.ArgumentParser(description='Monitor a shard of a robot fleet with a pool of worker processes. '
+                                                 'Robots are sharded over every running pool by consistent hashing')
+    addSensorArguments(parser)
+    addSchedulerArguments(parser, wakeup=False)
+    parser.add_argument('--robots', type=int, default=100,
+                        help='Number of robots in the fleet. Robots are addressed by IDs 0 to robots - 1')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Number of worker processes the shard is split over')
+    parser.add_argument('--heartbeat', type=float, default=1.0,
+                        help='Seconds between heartbeats, which is how often the shards are rebalanced')
+    parser.add_argument('--memberttl', type=int, default=3,
+                        help='Seconds after its last heartbeat that a pool is dropped and its shard taken over')
+    parser.add_argument('--slots', type=int, default=64, help='Largest number of pools sharing the fleet')
+    args = parser.parse_args()
+    if args.transport != 'memcached':
+        parser.error('the sensor pool shares its fleet through memcached; --transport must be memcached')
+
+    # Pools on the same host need different IDs. A pool restarted with the same ID gets the same shard back.
+    sensor_id = args.sensorid if args.sensorid is not None else '%s.%d' % (socket.gethostname(), os.getpid())
+    transport = createTransport(args)
+    membership = Membership(transport, sensor_id, slots=args.slots, ttl=args.memberttl)
+    robot_ids = list(range(args.robots))
+
+    # Workers are spawned rather than forked, so they start without this process's threads and connections.
+    context = multiprocessing.get_context('spawn')
+    stop = context.Event()
+    assignments = [context.Queue() for _ in range(args.workers)]
+    workers = [context.Process(target=runWorker, args=(i, args, sensor_id, assignments[i], stop),
+                               name='sensor-worker-%d' % i, daemon=True)
+               for i in range(args.workers)]
+    for worker in workers:
+        worker.start()
+
+    exit_code = 0
+    members = None
+    try:
+        while True:
+            if not all(worker.is_alive() for worker in workers):
+                logger.error("Sensor pool %s - A worker exited, stopping", sensor_id)
+                exit_code = 1
+                break
+            live = membership.heartbeat()
+            if live != members:
+                members = live
+                shard = HashRing(members).keysFor(membership.token, robot_ids)
+                logger.info("Sensor pool %s - %d pools running, monitoring %d of %d robots", sensor_id,
+                            len(members), len(shard), len(robot_ids))
+                for i, worker_queue in enumerate(assignments):
+                    worker_queue.put([robot_id for robot_id in shard if hashKey(robot_id) % len(workers) == i])
+                notifyReady()
+            if stop.wait(args.heartbeat):
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Leaves first, so the other pools take over the shard while the workers flush.
+        membership.leave()
+        stop.set()
+        for worker in workers:
+            worker.join(10)
+        transport.close()
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
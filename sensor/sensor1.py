@@ -1,14 +1,24 @@
 import numpy as np
 import time
-from datetime import datetime as dt
-import pylibmc
-import tkinter as tk
-from influxdb import InfluxDBClient
 import argparse
 import logging
+import os
 import sys
-
-# keys for memcached
+import threading
+import queue
+import socket
+from common import wire
+from common.influx_writer import InfluxWriter, formatLine
+from common.metrics import Metrics, addMetricsArguments, startMetrics
+from common.ready import notifyReady
+from common.spool import Spool
+from common.scheduler import addSchedulerArguments
+from common.transport import DEFAULT_WINDOW, MemcachedTransport, robotChannel, addTransportArguments, createTransport
+from common.wakeup import createWakeUp, wakeupName
+from sensor.engine import SensorEngine, SensorTimeoutError
+from sensor.estimator import RawEstimator, createEstimator
+
+# channels for the transport
 keyControllerToSensor = 'Controller.Sensor'
 keySensorToController = 'Sensor.Controller'
 keyRobotToSensor = 'Sensor.Robot'
@@ -19,57 +29,132 @@ logger = logging.getLogger(__name__)
 
 
 class Sensor:
-    def __init__(self, user, password, host, port, db_name, tolerance=0.000001, polling_rate=10, verbose=True):
+    def __init__(self, user, password, host, port, db_name, tolerance=0.000001, polling_rate=10, verbose=True,
+                 batch_size=500, flush_interval=1.0, queue_size=10000, overflow='drop', timeout=10,
+                 transport=None, estimator=None, robot_id=None, window=DEFAULT_WINDOW, metrics=None,
+                 writer=None, sensor_id=None, spool=None, min_polling_rate=None, wakeup=None):
         # Last location the sensor registered robot at.
         self.sensor_robot_location = None
 
         # Location the sensor expects the robot to be.
         self.expected_robot_location = None
 
-        # Last command sent by the controller.
+        # Moves the robot made since the previous report, including corrections.
         self.saved_controller_data = None
 
-        # client for connecting to memcached.
-        self.memcache_client = pylibmc.Client(['localhost'], binary=True, behaviors={"tcp_nodelay": True, "ketama": True})
+        # Buffers the planned and actual moves since the previous report, the error, which of its axes are over the
+        # tolerance, and the correction are computed in.
+        self.planned_move = np.zeros(3)
+        self.actual_move = np.zeros(3)
+        self.error = np.zeros(3)
+        self.over_tolerance = np.zeros(3, dtype=bool)
+        self.correction = np.zeros(3)
+
+        # Sequence number of the last command applied by the robot, as stamped on its reported location.
+        self.robot_seq = None
+
+        # Timestamp of the robot's last reported location, which tells a new report from one read again.
+        self.robot_ts = None
+
+        # Sequence number of the last command included in expected_robot_location.
+        self.expected_seq = None
+
+        # Commands sent by the controller and not yet applied by the robot, by sequence number.
+        self.planned_commands = {}
+
+        # Corrections the controller added to commands, by sequence number of the command carrying them.
+        self.applied_corrections = {}
+
+        # Sequence number of the next command expected from the controller.
+        self.next_command_seq = 1
 
-        # How large an error must be for the sensor to attempt to correct it.
-        # TODO: Implement sensor noise
-        self.tolerance = tolerance
+        # Number of commands the controller may have in flight. Must match the controller.
+        self.window = window
 
-        # How frequently the sensor scans the robot and controller.
+        # Transport for communicating with the controller and robot. Defaults to memcached.
+        self.transport = transport if transport is not None else MemcachedTransport()
+
+        # Latency histograms. The transport records its own latencies here too unless it already has metrics.
+        self.metrics = metrics if metrics is not None else Metrics('sensor')
+        if self.transport.metrics is None:
+            self.transport.metrics = self.metrics
+
+        # ID the robot is addressed by in channel names. None uses the channels shared by every robot.
+        self.robot_id = robot_id
+        self.channels = {key: robotChannel(key, robot_id)
+                         for key in (keyControllerToSensor, keySensorToController, keyRobotToSensor)}
+
+        # How large an error must be on each axis for the sensor to attempt to correct it.
+        # A scalar applies to every axis.
+        self.tolerance = wire.axisVector(tolerance)
+
+        # Estimates the robot's actual location from its reported location, which may be noisy.
+        # Defaults to trusting the reported location.
+        self.estimator = estimator if estimator is not None else RawEstimator()
+
+        # How frequently the sensor scans the robot and controller, and the least frequently it backs off to while
+        # the robot does not report. Defaults to not backing off.
         self.polling_rate = polling_rate
+        self.min_polling_rate = min(min_polling_rate, polling_rate) if min_polling_rate is not None else polling_rate
+
+        # common.wakeup.WakeUp that ends waits for the robot early, and that the controller is woken with once a
+        # correction is sent, if set.
+        self.wakeup = wakeup
+        self.wakeup_name = wakeupName('controller', robot_id)
 
         # Influx Database to write to.
         self.db_name = db_name
 
-        # Instantiates a DB client.
-        self.client = InfluxDBClient(host=host, username=user, password=password, database=db_name, port=port)
+        # Tags on every point written, so the DB can roll up the errors of each robot and sensor separately.
+        # The sensor defaults to the host name and a robot without an ID is tagged 'default'.
+        self.sensor_id = sensor_id if sensor_id is not None else socket.gethostname()
+        self.tags = {'robot': robot_id if robot_id is not None else 'default', 'sensor': self.sensor_id}
+
+        # Buffers points and writes them to the DB in batches on a background thread.
+        # Points go through spool, a common.spool.Spool, if given, and are kept on disk until written.
+        # A writer may be passed in instead, e.g. to collect the points without a DB.
+        if writer is None:
+            writer = createWriter(user, password, host, port, db_name, batch_size=batch_size,
+                                  flush_interval=flush_interval, queue_size=queue_size, overflow=overflow, spool=spool)
+        self.writer = writer
 
         # Verbose Logging.
         self.verbose = verbose
 
         # Timeout length in seconds
-        self.timeout = 10
+        self.timeout = timeout
 
-    # Gets the robot's latest location from the keyRobotToSensor key.
-    # The function will wait until the robot reports before returning data.
-    # TODO: Fix bug where time.sleep() causes the sensor GUI to hang.
-    def checkRobotLocation(self):
-        vector = self.memcache_client.get(keyRobotToSensor)
+        # Set to interrupt any wait for the robot, e.g. when the sensor is shutting down.
+        self.stop_event = threading.Event()
 
-        # Counter to time out sensor if no data is found.
-        i = 0
+    # Takes the robot's latest location record from the keyRobotToSensor key. The record is read and consumed
+    # in one step, so a location the robot reports meanwhile is never discarded unread.
+    # The function will wait until the robot reports before returning data, so it must not run on the GUI thread.
+    # It polls at polling_rate at first and backs off exponentially to min_polling_rate, unless woken sooner.
+    # Returns None if stop_event is set while waiting.
+    # Raises SensorTimeoutError if the robot does not report in time.
+    def checkRobotLocation(self):
+        record = self.transport.takeRecord(self.channels[keyRobotToSensor])
+        deadline = time.monotonic() + self.timeout
+        delay = 1 / self.polling_rate
 
         # Waits for the next robot location update
-        while vector is None:
-            vector = self.memcache_client.get(keyRobotToSensor)
-            time.sleep(1 / self.polling_rate)
-            i += 1
-            if i > self.timeout * self.polling_rate:
-                logging.error("Sensor - Sensor waiting for robot time out")
-                sys.exit(1)
-
-        return vector
+        while record is None:
+            if self.waitForMessages(delay):
+                return None
+            record = self.transport.takeRecord(self.channels[keyRobotToSensor])
+            if record is None and time.monotonic() > deadline:
+                raise SensorTimeoutError()
+            delay = min(delay * 2, 1 / self.min_polling_rate)
+
+        return record
+
+    # Waits up to delay seconds, ending early if woken. Returns True if stop_event is set.
+    def waitForMessages(self, delay):
+        if self.wakeup is None or not self.wakeup.listening:
+            return self.stop_event.wait(delay)
+        self.wakeup.wait(delay)
+        return self.stop_event.is_set()
 
     # Accessor functino to get robot's last recorded location
     def getSensorRobotLocation(self):
@@ -79,137 +164,325 @@ class Sensor:
     def getSensorExpectedLocation(self):
         return self.expected_robot_location
 
-    # Gets robot's latest location at the keyRobotToSensor key and clears the value from memcache
+    # Gets robot's latest location from the keyRobotToSensor channel and consumes it from the transport
     def fetchSensorRobotLocation(self):
-        vector = self.checkRobotLocation()
-        if vector is not None and type(vector).__module__ == np.__name__:
-            self.sensor_robot_location = vector
-            self.memcache_client.delete(keyRobotToSensor)
+        record = self.checkRobotLocation()
+        if record is not None:
+            self.receiveRobotLocation(record)
         return self.sensor_robot_location
 
-    # Gets the controller's command to the robot from the keyControllerToSensor key.
-    # Saves the data as the last sent command.
-    def getControllerData(self):
-        controller_data = self.memcache_client.get(keyControllerToSensor)
-        if controller_data is not None:
-            self.saved_controller_data = controller_data
-            self.memcache_client.delete(keyControllerToSensor)
-        return controller_data
+    # Registers a location record of the robot already read from the keyRobotToSensor channel.
+    def receiveRobotLocation(self, record):
+        self.metrics.observeHop('robot_to_sensor', record)
+        self.sensor_robot_location = record['xyz']
+        self.robot_seq = int(record['seq'])
+        self.robot_ts = int(record['ts'])
+
+    # Returns the keyControllerToSensor window slots the controller's next commands may be in.
+    def controllerSlots(self):
+        return [self.transport.windowSlot(self.channels[keyControllerToSensor], seq, self.window)
+                for seq in range(self.next_command_seq, self.next_command_seq + self.window)]
+
+    # Gets the controller's commands to the robot from the keyControllerToSensor window slots in sequence order,
+    # reading every slot in one takeBatches. A slot holds the command, followed by the correction the controller
+    # added to it if there was one.
+    # @param batches Batches already taken from the controllerSlots, by channel. If None, they are taken here.
+    # Returns the number of new commands.
+    def getControllerData(self, batches=None):
+        if batches is None:
+            batches = self.transport.takeBatches(self.controllerSlots())
+        batches = list(batches.values())
+        if not batches:
+            return 0
+        records = np.concatenate(batches)
+        count = 0
+        previous = None
+        for record in records[np.argsort(records['seq'], kind='stable')]:
+            seq = int(record['seq'])
+            if seq == previous:
+                self.applied_corrections[seq] = record['xyz']
+                continue
+            previous = None
+            self.metrics.observeHop('controller_to_sensor', record)
+            if seq < self.next_command_seq:
+                # A command left over from an earlier run of the controller.
+                continue
+            if seq > self.next_command_seq and self.expected_seq is not None:
+                # Before the first location, e.g. when taking over a robot from another sensor, earlier commands
+                # are not needed.
+                logger.warning("Sensor - Lost commands %d to %d", self.next_command_seq, seq - 1)
+            self.planned_commands[seq] = record['xyz']
+            self.next_command_seq = seq + 1
+            previous = seq
+            count += 1
+        return count
 
     # Sends correctional data to the controller through the keySensorToController key.
-    def sendDataToController(self, vector):
-        if vector is not None and type(vector).__module__ == np.__name__:
-            self.memcache_client.set(keySensorToController, vector)
-
-    # Updates the estimated location of the robot if the conditions are met.
+    # The correction is stamped with the sequence number of the command after which the error was observed,
+    # so the controller can tell which of its corrections the observation already includes.
+    # @param batches If given, the correction is added to these batches by channel, to be sent with putMany,
+    # instead of being sent here.
+    def sendDataToController(self, vector, batches=None):
+        if vector is None:
+            return
+        if batches is None:
+            self.transport.put(self.channels[keySensorToController], vector, seq=self.robot_seq)
+            if self.wakeup is not None:
+                self.wakeup.notify(self.wakeup_name)
+            return
+        records = wire.makeRecords(1)
+        records['seq'] = self.robot_seq
+        records['ts'] = time.monotonic_ns()
+        records['xyz'] = vector
+        batches[self.channels[keySensorToController]] = records
+
+    # Advances the expected location of the robot through the commands the robot has applied since the last report.
+    # Returns True if the robot has made a new move to check.
+    # If a command is missing the expected location restarts from the robot's reported location.
     def updateEstimate(self):
-        if self.expected_robot_location is None and (self.sensor_robot_location is not None
-                                                     and self.saved_controller_data is not None):
-            self.expected_robot_location = self.sensor_robot_location + self.saved_controller_data
-        elif self.expected_robot_location is not None:
-            self.expected_robot_location += self.saved_controller_data
-
-    # Calculates the amount of error the robot has made on the y-axis and sends correctional data to the controller.
+        if self.sensor_robot_location is None:
+            return False
+        if self.expected_seq is None:
+            self.resetExpectedLocation()
+            return False
+        if self.robot_seq <= self.expected_seq:
+            return False
+        if any(seq not in self.planned_commands for seq in range(self.expected_seq + 1, self.robot_seq + 1)):
+            # The robot may have applied a command before the sensor read it.
+            self.getControllerData()
+        planned = self.planned_move
+        moved = self.actual_move
+        planned.fill(0)
+        moved.fill(0)
+        for seq in range(self.expected_seq + 1, self.robot_seq + 1):
+            command = self.planned_commands.pop(seq, None)
+            if command is None:
+                logger.warning("Sensor - Missing command %d, restarting from the robot's location", seq)
+                self.resetExpectedLocation()
+                return False
+            planned += command
+            moved += command
+            correction = self.applied_corrections.pop(seq, None)
+            if correction is not None:
+                moved += correction
+        self.expected_robot_location += planned
+        self.saved_controller_data = moved
+        self.expected_seq = self.robot_seq
+        return True
+
+    # Restarts the expected location from the robot's reported location.
+    def resetExpectedLocation(self):
+        self.expected_robot_location = np.array(self.sensor_robot_location, dtype=np.float64)
+        self.expected_seq = self.robot_seq
+        self.estimator.reset()
+        for seq in [seq for seq in self.planned_commands if seq <= self.robot_seq]:
+            del self.planned_commands[seq]
+
+    # Calculates the amount of error the robot has made on each axis and sends correctional data to the controller.
+    # The error is measured against the estimator's estimate of the robot's location rather than the raw report.
+    # The correction is the error on the axes where it is over the tolerance, and zero on the others.
     # Writes the error to InfluxDB for reporting.
     # Does not send data to the controller if sensor is disabled in the GUI.
     # Technically sensor isn't disabled, but it is necessary to record the error.
-    def sendCorrectionData(self, is_sensor_on):
-        actual_pos = self.checkRobotLocation()
-        diff = self.expected_robot_location - actual_pos
-        self.writeToDB(diff[1])
-        if abs(diff[1]) > self.tolerance and is_sensor_on:
+    # @param batches Passed on to sendDataToController.
+    def sendCorrectionData(self, is_sensor_on, batches=None):
+        actual_pos = self.estimator.step(self.saved_controller_data, self.sensor_robot_location)
+        diff = np.subtract(self.expected_robot_location, actual_pos, out=self.error)
+        self.writeToDB(diff)
+        over_tolerance = np.greater(np.abs(diff, out=self.correction), self.tolerance, out=self.over_tolerance)
+        if over_tolerance.any() and is_sensor_on:
             if self.doILog():
-                logstr = "Sensor: Expected location: " + np.array2string(self.expected_robot_location)\
-                         + "Actual Location: ", np.array2string(actual_pos)
-                logger.info('%s', logstr)
-            self.sendDataToController(diff)
+                logger.info("Sensor: Expected location: %s Actual Location: %s", self.expected_robot_location,
+                            actual_pos)
+            self.sendDataToController(np.multiply(diff, over_tolerance, out=self.correction), batches=batches)
 
-    # Clears sensor data in memcache (not used)
+    # Clears sensor data in the transport. Used by the engine to reset after a timeout.
     def clearSensorRobotLocation(self):
         if self.getSensorRobotLocation is not None:
             self.sensor_robot_location = None
         if self.getSensorExpectedLocation is not None:
             self.expected_robot_location = None
-        if self.memcache_client.get(keyControllerToSensor) is not None:
-            self.memcache_client.delete(keyControllerToSensor)
-        if self.memcache_client.get(keyRobotToSensor) is not None:
-            self.memcache_client.delete(keyRobotToSensor)
-
-    # Writes data to the DB specified in the sensor's parameters.
-    # Timestamp is the current UTC time in milliseconds.
-    def writeToDB(self, data):
-        databases = self.client.get_list_database()
-        db_check = {'name': self.db_name}
-        if db_check in databases:
-            json_body = [{
-                    "measurement": "robot_sensor",
-                    "time": dt.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
-                    "fields": {
-                        "error": data
-                    }
-                }]
-            try:
-                self.client.write_points(json_body)
-                logger.info("Writing to DB: %s", json_body)
-            except Exception as exception:
-                logger.error("Exception writing to DB: %s", exception)
+        self.expected_seq = None
+        self.planned_commands = {}
+        self.applied_corrections = {}
+        self.estimator.reset()
+        channels = set(self.controllerSlots())
+        channels.add(self.channels[keyRobotToSensor])
+        self.transport.discardMany(sorted(channels))
+
+    # Queues an error for writing to the DB specified in the sensor's parameters, as one point with fields for the
+    # signed error and its magnitude on each axis, tagged with the robot and sensor IDs.
+    # Timestamp is the current UTC time in nanoseconds. The write itself happens on the writer thread.
+    def writeToDB(self, error):
+        fields = {"error_x": error[0], "error_y": error[1], "error_z": error[2],
+                  "abs_error_x": abs(error[0]), "abs_error_y": abs(error[1]), "abs_error_z": abs(error[2])}
+        line = formatLine("robot_sensor", fields, tags=self.tags, timestamp_ns=time.time_ns())
+        if line is not None:
+            self.writer.write(line)
 
     # Function to output info logging
     def doILog(self):
         return self.verbose
 
 
-def main():
-    # Code for parsing command line arguments
-    parser = argparse.ArgumentParser(description='Sensor setup')
+# Creates an InfluxWriter with its own DB client. The writer must be started before points are written.
+# @param spool common.spool.Spool to keep the points in until they are written, if given.
+def createWriter(user, password, host, port, db_name, batch_size=500, flush_interval=1.0, queue_size=10000,
+                 overflow='drop', spool=None):
+    from influxdb import InfluxDBClient
+
+    client = InfluxDBClient(host=host, username=user, password=password, database=db_name, port=port)
+    return InfluxWriter(client, db_name, batch_size=batch_size, flush_interval=flush_interval,
+                        queue_size=queue_size, overflow=overflow, spool=spool)
+
+
+# Creates the InfluxWriter chosen on the command line, spooling in the named directory under --spooldir.
+def createWriterFromArgs(args, spool_name):
+    spool = None
+    if not args.nospool:
+        spool = Spool(os.path.join(args.spooldir, spool_name), max_bytes=args.spoolsize * 1024 * 1024)
+    return createWriter(args.user, args.password, args.host, args.port, args.dbname, batch_size=args.batchsize,
+                        flush_interval=args.flushinterval, queue_size=args.queuesize, overflow=args.overflow,
+                        spool=spool)
+
+
+# Adds the command line arguments shared by the sensor and the sensor pool.
+def addSensorArguments(parser):
     parser.add_argument('--user', help='Username for DB')
     parser.add_argument('--password', help='Password for DB')
     parser.add_argument('--host', help='Host for connecting to DB')
     parser.add_argument('--port', type=int, help='Port for connecting to DB')
     parser.add_argument('--dbname', help='Database to insert data to')
     parser.add_argument('--verbose', action='store_true', help='If true, provide verbose output')
-    args = parser.parse_args()
-
-    user = args.user
-    password = args.password
-    host = args.host
-    port = args.port
-    db_name = args.dbname
-    verbose = args.verbose
+    parser.add_argument('--batchsize', type=int, default=500, help='Number of points written to the DB per batch')
+    parser.add_argument('--flushinterval', type=float, default=1.0,
+                        help='Maximum number of seconds a point waits before being written to the DB')
+    parser.add_argument('--queuesize', type=int, default=10000, help='Maximum number of points waiting to be written')
+    parser.add_argument('--overflow', choices=['drop', 'block'], default='drop',
+                        help='Drop new points or block the sensor when the write queue is full')
+    parser.add_argument('--spooldir', default='spool',
+                        help='Directory the points are spooled in until they are written to the DB')
+    parser.add_argument('--spoolsize', type=int, default=256,
+                        help='Maximum megabytes of spooled points. The oldest are discarded beyond it')
+    parser.add_argument('--nospool', action='store_true',
+                        help='If true, queue points in memory instead, dropping them if the DB is down')
+    parser.add_argument('--pollingrate', type=int, default=100,
+                        help='How many times per second the sensor checks for a new robot location while the robot '
+                             'reports')
+    parser.add_argument('--tolerance', type=wire.parseAxes, default=0.000001,
+                        help='Smallest error the sensor will correct, on every axis or on each axis given as x,y,z')
+    parser.add_argument('--estimator', choices=['raw', 'kalman'], default='raw',
+                        help='Trust the robot\'s reported location or filter it with a Kalman filter')
+    parser.add_argument('--processnoise', type=float, default=0.25,
+                        help='Kalman filter variance of the robot\'s movement per command')
+    parser.add_argument('--measurementnoise', type=float, default=0.01,
+                        help='Kalman filter variance of the robot\'s reported location')
+    addTransportArguments(parser)
+    addMetricsArguments(parser, influx=False)
+    parser.add_argument('--sensorid', help='ID the sensor tags its points with. Defaults to the host name')
+
+
+# Tkinter gui. An optional front-end that displays the updates handed over by the engine.
+def runGui(s, engine):
+    import tkinter as tk
 
-    # Instantiates a Sensor object with the specified parameters
-    s = Sensor(user, password, host, port, db_name, verbose=verbose)
     sensor_gui = tk.Tk()
 
-    # Main loop that is run by tkinter
-    # Note that this loop will hang when the sensor waits for the next robot's location to be updated.
+    # How often the window checks for updates, independent of the sensor's polling rate.
+    refresh_ms = 50
+
+    # GUI loop that is run by tkinter.
     def run():
-        controller_data = s.getControllerData()
-        s.fetchSensorRobotLocation()
-        if s.doILog() and loop.get():
-            logstr = "Sensor Robot Location: " + np.array2string(s.getSensorRobotLocation())
-            logger.info('%s', logstr)
-        if controller_data is not None and s.getSensorRobotLocation() is not None:
-            s.updateEstimate()
-            s.sendCorrectionData(loop.get())
-        sensor_gui.after(1000 // s.polling_rate, run)
+        for location, _ in engine.drain():
+            if s.doILog() and loop.get():
+                logger.info("Sensor Robot Location: %s", location)
+        if not engine.isRunning():
+            sensor_gui.destroy()
+            return
+        sensor_gui.after(refresh_ms, run)
 
     sensor_gui.title('Robot Sensor')
     sensor_gui.geometry('200x200')
     loop = tk.BooleanVar(sensor_gui)
     loop.set(True)
-    radiobutton_widget1 = tk.Radiobutton(sensor_gui, text="Hold to Enable Sensor", variable=loop, value=True,
-                                         indicatoron=False, command=run)
-    radiobutton_widget2 = tk.Radiobutton(sensor_gui, text="Hold to Disable Sensor", variable=loop, value=False,
-                                         indicatoron=False, command=run)
-    exit_button = tk.Button(sensor_gui, text="Hold to Exit", command=sensor_gui.destroy)
+    radiobutton_widget1 = tk.Radiobutton(sensor_gui, text="Enable Sensor", variable=loop, value=True,
+                                         indicatoron=False, command=lambda: engine.setEnabled(True))
+    radiobutton_widget2 = tk.Radiobutton(sensor_gui, text="Disable Sensor", variable=loop, value=False,
+                                         indicatoron=False, command=lambda: engine.setEnabled(False))
+    exit_button = tk.Button(sensor_gui, text="Exit", command=sensor_gui.destroy)
 
     radiobutton_widget1.pack()
     radiobutton_widget2.pack()
     exit_button.pack()
 
-    sensor_gui.after(1000, run)
+    sensor_gui.after(refresh_ms, run)
     sensor_gui.mainloop()
 
 
-main()
+# Headless front-end. Logs the updates handed over by the engine until it stops or Ctrl-C is pressed.
+def runHeadless(s, engine):
+    try:
+        while engine.isRunning():
+            try:
+                location, _ = engine.updates.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if s.doILog():
+                logger.info("Sensor Robot Location: %s", location)
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    # Code for parsing command line arguments
+    parser = argparse.ArgumentParser(description='Sensor setup')
+    addSensorArguments(parser)
+    parser.add_argument('--timeout', type=float, default=10,
+                        help='Seconds to wait for the robot to report its location before timing out')
+    parser.add_argument('--ontimeout', choices=['exit', 'retry', 'reset'], default='exit',
+                        help='Exit, keep waiting, or reset the sensor state when the robot times out')
+    parser.add_argument('--headless', action='store_true', help='If true, run without the tkinter window')
+    parser.add_argument('--robotid', help='ID of the robot to monitor, e.g. one robot of a fleet')
+    addSchedulerArguments(parser)
+    args = parser.parse_args()
+
+    user = args.user
+    password = args.password
+    host = args.host
+    port = args.port
+    db_name = args.dbname
+    verbose = args.verbose
+
+    # Instantiates a Sensor object with the specified parameters
+    estimator = createEstimator(args.estimator, process_noise=args.processnoise,
+                                measurement_noise=args.measurementnoise)
+    metrics = Metrics('sensor')
+    writer = createWriterFromArgs(args, args.robotid if args.robotid is not None else 'default')
+    s = Sensor(user, password, host, port, db_name, tolerance=args.tolerance, polling_rate=args.pollingrate,
+               verbose=verbose, timeout=args.timeout, transport=createTransport(args), estimator=estimator,
+               robot_id=args.robotid, window=args.window, metrics=metrics, writer=writer, sensor_id=args.sensorid,
+               min_polling_rate=args.minrate, wakeup=createWakeUp(args, 'sensor', args.robotid))
+    s.writer.start()
+
+    # Latency metrics are exported through the sensor's own writer.
+    reporter = startMetrics(args, metrics, writer=s.writer)
+
+    # Transport I/O and estimation run on the engine thread so waiting for the robot never blocks the GUI.
+    engine = SensorEngine(s, on_timeout=args.ontimeout)
+    engine.start()
+    notifyReady()
+    if args.headless:
+        runHeadless(s, engine)
+    else:
+        runGui(s, engine)
+
+    engine.stop()
+    reporter.stop()
+
+    # Flush any points still waiting to be written.
+    s.writer.close()
+    sys.exit(engine.exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+from supervisor.supervisor import main
+
+# Runs the supervisor with "python3 -m supervisor".
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,408 @@
+import argparse
+import logging
+import os
+import select
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+from common.httpserve import serveMetrics
+from common.ready import READY_FD
+
+# logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Repository root, which the components are run from as modules.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# A component process run by the supervisor, e.g. 'python3 -m robot.robot'.
+class Component:
+    def __init__(self, name, module, args, cores=(), metrics_ports=(), restart_args=(), dependents=()):
+        # Name used in logs and as the instance label of its metrics, e.g. 'controller.3'.
+        self.name = name
+
+        # Module run with python3 -m, and its arguments.
+        self.module = module
+        self.args = list(args)
+
+        # Arguments added when the component is restarted, e.g. so a controller does not flush the transport.
+        self.restart_args = list(restart_args)
+
+        # Components restarted along with this one, e.g. the robot and sensor, whose command numbers restart with
+        # the controller's.
+        self.dependents = list(dependents)
+
+        # CPUs the process is pinned to. Empty to leave it unpinned.
+        self.cores = set(cores)
+
+        # Ports the process serves Prometheus metrics on. The first is passed as --metricsport; a sensor pool's
+        # workers take the ones after it.
+        self.metrics_ports = list(metrics_ports)
+
+        self.process = None
+        self._ready_fd = None
+
+        # Number of times the process was started, and of consecutive failures.
+        self.starts = 0
+        self.failures = 0
+
+        # Monotonic time the process was last started, and when it is due to be restarted if it has failed.
+        self.started_at = None
+        self.restart_at = None
+
+        # True once the process has exited successfully. It is not restarted.
+        self.done = False
+
+    def argv(self):
+        args = self.args + (self.restart_args if self.starts else [])
+        if self.metrics_ports:
+            args += ['--metricsport', str(self.metrics_ports[0])]
+        return [sys.executable, '-m', self.module] + args
+
+    # Starts the process in its own session, so Ctrl-C reaches only the supervisor, which stops it in order.
+    # The process inherits the write end of a pipe named by READY_FD, which common.ready.notifyReady writes to.
+    def start(self):
+        read_fd, write_fd = os.pipe()
+        env = dict(os.environ)
+        env[READY_FD] = str(write_fd)
+        try:
+            self.process = subprocess.Popen(self.argv(), cwd=ROOT, env=env, pass_fds=(write_fd,),
+                                            start_new_session=True)
+        finally:
+            os.close(write_fd)
+        self._ready_fd = read_fd
+        self.starts += 1
+        self.started_at = time.monotonic()
+        self.restart_at = None
+        if self.cores:
+            try:
+                os.sched_setaffinity(self.process.pid, self.cores)
+            except OSError as exception:
+                logger.warning("Could not pin %s to CPUs %s: %s", self.name, sorted(self.cores), exception)
+        logger.info("Started %s, pid %d%s", self.name, self.process.pid,
+                    ', on CPUs %s' % sorted(self.cores) if self.cores else '')
+
+    # Waits until the process reports that it is ready. Returns False if it exits first or does not report
+    # within timeout seconds.
+    def waitReady(self, timeout):
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.error("%s did not become ready within %g s", self.name, timeout)
+                    return False
+                readable, _, _ = select.select([self._ready_fd], [], [], remaining)
+                if readable:
+                    # Reads nothing if the process exited without reporting.
+                    if os.read(self._ready_fd, 64).startswith(b'ready'):
+                        return True
+                    logger.error("%s exited before becoming ready", self.name)
+                    return False
+        finally:
+            os.close(self._ready_fd)
+            self._ready_fd = None
+
+    # Returns the exit code of the process, or None if it is running.
+    def poll(self):
+        return None if self.process is None else self.process.poll()
+
+    # Interrupts the process like Ctrl-C, and kills its session if it has not exited within timeout seconds.
+    def stop(self, timeout):
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.process.send_signal(signal.SIGINT)
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning("%s did not stop within %g s, killing it", self.name, timeout)
+            os.killpg(self.process.pid, signal.SIGKILL)
+            self.process.wait()
+
+
+# Merges Prometheus text from several processes, adding an instance label to each sample so that processes of the
+# same component can be told apart. Each family's TYPE line appears once, followed by all of its samples.
+# @param texts List of (instance, text) pairs.
+def mergePrometheus(texts):
+    types = {}
+    samples = {}
+    for instance, text in texts:
+        family = None
+        for line in text.splitlines():
+            if line.startswith('# TYPE '):
+                family = line.split()[2]
+                types.setdefault(family, line)
+                samples.setdefault(family, [])
+            elif line and not line.startswith('#') and family is not None:
+                name, brace, rest = line.partition('{')
+                if brace:
+                    samples[family].append('%s{instance="%s",%s' % (name, instance, rest))
+                else:
+                    name, _, value = line.partition(' ')
+                    samples[family].append('%s{instance="%s"} %s' % (name, instance, value))
+    lines = []
+    for family in types:
+        lines.append(types[family])
+        lines.extend(samples[family])
+    return '\n'.join(lines) + '\n'
+
+
+# Starts components in order, each once the one before it is ready, and restarts any that fail, waiting
+# min_backoff seconds after the first failure and doubling up to max_backoff after each consecutive one.
+# A component that stays up for stable_time seconds starts again from min_backoff.
+class Supervisor:
+    def __init__(self, components, ready_timeout=30.0, min_backoff=0.5, max_backoff=30.0, stable_time=60.0,
+                 stop_timeout=10.0):
+        self.components = components
+        self.ready_timeout = ready_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.stable_time = stable_time
+        self.stop_timeout = stop_timeout
+
+        self._stop = threading.Event()
+        self._server = None
+
+    # Starts every component in order. Returns False, having stopped them again, if one does not become ready.
+    def start(self):
+        start = time.perf_counter()
+        for component in self.components:
+            component.start()
+            if not component.waitReady(self.ready_timeout):
+                self.stop()
+                return False
+        logger.info("Started %d components in %.2f s", len(self.components), time.perf_counter() - start)
+        return True
+
+    # Restarts failed components until stopped or every component has exited successfully.
+    def run(self, interval=0.2):
+        while not self._stop.wait(interval):
+            now = time.monotonic()
+            for component in self.components:
+                if component.done:
+                    continue
+                code = component.poll()
+                if code is None:
+                    if component.failures and now - component.started_at >= self.stable_time:
+                        component.failures = 0
+                    continue
+                if component.restart_at is None:
+                    if code == 0:
+                        logger.info("%s exited", component.name)
+                        component.done = True
+                        continue
+                    delay = self.scheduleRestart(component, now)
+                    logger.warning("%s exited with code %d, restarting in %.1f s", component.name, code, delay)
+                elif now >= component.restart_at:
+                    self.restart(component)
+            if all(component.done for component in self.components):
+                return
+
+    # Counts a failure of the component and schedules its restart after a backoff that doubles after each
+    # consecutive failure. Returns the backoff in seconds.
+    def scheduleRestart(self, component, now):
+        component.failures += 1
+        delay = min(self.max_backoff, self.min_backoff * 2 ** (component.failures - 1))
+        component.restart_at = now + delay
+        return delay
+
+    # Restarts a failed component, then its dependents. If one of them does not become ready, all of them are
+    # stopped and counted as another failure of the component, which is restarted with them after its backoff.
+    # Returns True if they all became ready.
+    def restart(self, component):
+        restarting = [component] + component.dependents
+        for dependent in component.dependents:
+            dependent.stop(self.stop_timeout)
+        for restarted in restarting:
+            restarted.done = False
+            restarted.start()
+            if not restarted.waitReady(self.ready_timeout):
+                for stopped in reversed(restarting):
+                    stopped.stop(self.stop_timeout)
+                delay = self.scheduleRestart(component, time.monotonic())
+                for dependent in component.dependents:
+                    dependent.restart_at = component.restart_at
+                logger.warning("%s did not restart, restarting in %.1f s", component.name, delay)
+                return False
+        return True
+
+    # Stops run, and every component in the reverse of the order they were started in.
+    def stop(self):
+        self._stop.set()
+        for component in reversed(self.components):
+            component.stop(self.stop_timeout)
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+    # Returns the metrics of every component, and whether each is up and how often it was restarted,
+    # as Prometheus text.
+    def collectMetrics(self, timeout=1.0):
+        import urllib.request
+
+        status = ['# TYPE rcs_process_up gauge']
+        status += ['rcs_process_up{instance="%s"} %d' % (component.name,
+                                                         component.process is not None and component.poll() is None)
+                   for component in self.components]
+        status.append('# TYPE rcs_process_restarts counter')
+        status += ['rcs_process_restarts{instance="%s"} %d' % (component.name, max(component.starts - 1, 0))
+                   for component in self.components]
+        texts = []
+        for component in self.components:
+            for i, port in enumerate(component.metrics_ports):
+                # A sensor pool's workers each serve their own.
+                instance = component.name if len(component.metrics_ports) == 1 else '%s.w%d' % (component.name, i)
+                try:
+                    with urllib.request.urlopen('http://localhost:%d/metrics' % port, timeout=timeout) as response:
+                        texts.append((instance, response.read().decode()))
+                except OSError:
+                    # Not up yet, or restarting.
+                    continue
+        return '\n'.join(status) + '\n' + mergePrometheus(texts)
+
+    # Serves collectMetrics on http://localhost:<port>/metrics.
+    def serveMetrics(self, port):
+        self._server = serveMetrics(port, self.collectMetrics)
+
+
+# Hands out CPUs round-robin from the ones this process may run on.
+class CorePlanner:
+    def __init__(self, enabled=True):
+        self.cores = sorted(os.sched_getaffinity(0)) if enabled else []
+        self.next = 0
+
+    # Returns the next count CPUs, or none if pinning is disabled.
+    def take(self, count=1):
+        if not self.cores:
+            return []
+        cores = [self.cores[(self.next + i) % len(self.cores)] for i in range(min(count, len(self.cores)))]
+        self.next += count
+        return cores
+
+
+# Builds the components to run from the command line, in the order they must start: the controllers, which
+# flush the transport, then the sensors, then the robots.
+def buildComponents(args):
+    planner = CorePlanner(enabled=not args.nopin)
+    next_port = [args.metricsport + 1 if args.metricsport is not None else None]
+
+    def ports(count=1):
+        if next_port[0] is None:
+            return []
+        start = next_port[0]
+        next_port[0] += count
+        return list(range(start, start + count))
+
+    shared = ['--transport', args.transport, '--servers', args.servers, '--window', str(args.window),
+              '--metricsinterval', str(args.metricsinterval)]
+    if args.minrate is not None:
+        shared += ['--minrate', str(args.minrate)]
+    db = ['--host', args.host, '--port', str(args.port), '--user', args.user, '--password', args.password,
+          '--dbname', args.dbname]
+    controller_args = shared + ['--data', args.data, '--rate', str(args.rate), '--headless'] + \
+        shlex.split(args.controllerargs)
+    robot_args = shared + ['--rate', str(args.rate)] + shlex.split(args.robotargs)
+    sensor_args = shared + db + shlex.split(args.sensorargs)
+    if args.randomerror:
+        robot_args += ['--randomerror']
+    if args.verbose:
+        controller_args += ['--verbose']
+        robot_args += ['--verbose']
+        sensor_args += ['--verbose']
+
+    if not args.robots:
+        controller = Component('controller', 'controller.controller', controller_args, cores=planner.take(),
+                               metrics_ports=ports())
+        sensor = Component('sensor', 'sensor.sensor1', sensor_args + ['--headless'], cores=planner.take(),
+                           metrics_ports=ports())
+        robot = Component('robot', 'robot.robot', robot_args + ['--headless'], cores=planner.take(),
+                          metrics_ports=ports())
+        controller.dependents = [sensor, robot]
+        return [controller, sensor, robot]
+
+    # Only the first controller flushes the transport, before anything else is running. A restarted controller
+    # leaves the other robots' messages alone. The fleet and pools are not restarted with it, so it continues its
+    # mission after the last command its robot acknowledged, instead of starting over from the robot's location.
+    components = [Component('controller.%d' % i, 'controller.controller',
+                            controller_args + ['--robotid', str(i)] + (['--noflush'] if i else []),
+                            cores=planner.take(), metrics_ports=ports(),
+                            restart_args=['--resume'] + (['--noflush'] if not i else []))
+                  for i in range(args.robots)]
+    components += [Component('sensor.pool.%d' % i, 'sensor.pool',
+                             sensor_args + ['--robots', str(args.robots), '--workers', str(args.workers),
+                                            '--sensorid', '%s.%d' % (args.sensorid, i)],
+                             cores=planner.take(args.workers), metrics_ports=ports(args.workers))
+                   for i in range(args.pools)]
+    components.append(Component('robot.fleet', 'robot.fleet', robot_args + ['--count', str(args.robots)],
+                                cores=planner.take(), metrics_ports=ports()))
+    return components
+
+
+def main():
+    # Code for parsing command line arguments
+    parser = argparse.ArgumentParser(description='Start the controller, sensor and robot, or a fleet of each, '
+                                                 'and restart any that fail')
+    parser.add_argument('--data', default='data/simple.csv', help='Command file the controllers read')
+    parser.add_argument('--robots', type=int, default=0,
+                        help='Number of robots of a fleet, each with its own controller, monitored by sensor pools. '
+                             '0 runs a single controller, sensor and robot')
+    parser.add_argument('--pools', type=int, default=1, help='Number of sensor pools monitoring a fleet')
+    parser.add_argument('--workers', type=int, default=2, help='Number of worker processes per sensor pool')
+    parser.add_argument('--sensorid', default='sensor', help='Prefix of the sensor pools\' IDs')
+    parser.add_argument('--rate', type=float, default=1.0, help='Commands sent and moves made per second')
+    parser.add_argument('--minrate', type=float,
+                        help='Ticks per second the components back off to while idle. Their own default if unset')
+    parser.add_argument('--randomerror', action='store_true', help='If true, the robots randomly err')
+    parser.add_argument('--verbose', action='store_true', help='If true, the components provide verbose output')
+    parser.add_argument('--host', default='localhost', help='Host for connecting to DB')
+    parser.add_argument('--port', type=int, default=8086, help='Port for connecting to DB')
+    parser.add_argument('--user', default='root', help='Username for DB')
+    parser.add_argument('--password', default='root', help='Password for DB')
+    parser.add_argument('--dbname', default='sensor', help='Database to insert data to')
+    parser.add_argument('--transport', choices=['memcached', 'shm'], default='memcached',
+                        help='Transport the components use')
+    parser.add_argument('--servers', default='localhost', help='Comma-separated memcached servers')
+    parser.add_argument('--window', type=int, default=4, help='Number of commands the controllers may have in flight')
+    parser.add_argument('--controllerargs', default='',
+                        help='More arguments for the controllers, e.g. "--chunksize 1024"')
+    parser.add_argument('--robotargs', default='', help='More arguments for the robots, e.g. "--sensornoise 0.1"')
+    parser.add_argument('--sensorargs', default='', help='More arguments for the sensors, e.g. "--estimator kalman"')
+    parser.add_argument('--nopin', action='store_true', help='If true, do not pin the components to CPUs')
+    parser.add_argument('--readytimeout', type=float, default=30.0,
+                        help='Seconds a component may take to become ready before startup is abandoned')
+    parser.add_argument('--minbackoff', type=float, default=0.5, help='Seconds before restarting a failed component')
+    parser.add_argument('--maxbackoff', type=float, default=30.0,
+                        help='Longest wait before restarting a component that keeps failing')
+    parser.add_argument('--metricsport', type=int,
+                        help='Serve every component\'s Prometheus metrics on this port. The components use the '
+                             'ports after it')
+    parser.add_argument('--metricsinterval', type=float, default=10.0,
+                        help='Seconds between the components\' metrics snapshots')
+    args = parser.parse_args()
+
+    supervisor = Supervisor(buildComponents(args), ready_timeout=args.readytimeout, min_backoff=args.minbackoff,
+                            max_backoff=args.maxbackoff)
+
+    # SIGTERM stops the components like Ctrl-C.
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        if args.metricsport is not None:
+            supervisor.serveMetrics(args.metricsport)
+        if not supervisor.start():
+            sys.exit(1)
+        supervisor.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+
+
+if __name__ == '__main__':
+    main()